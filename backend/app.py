@@ -1,15 +1,31 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import os
 import shutil
 from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+import glob
 import json
+import multiprocessing
+import tempfile
+import threading
+import time
+import uuid
 
-from utils.feature_extraction import extract_features
-from utils.run_detection import run_detection
-from utils.generate_reports import generate_all_reports
-from utils.helper import allowed_file, cleanup_temp_folders, get_file_size
+from utils.feature_extraction import (extract_features, compute_partial_aggregates, merge_partial_aggregates,
+                                      finalize_features, build_extraction_stats, FEATURE_VERSION)
+from utils.preview import sample_log_rows, estimate_features, iter_progressive_partials
+from utils.run_detection import (run_detection, load_models, load_sklearn_models, load_autoencoder,
+                                 AE_THRESHOLD_PERCENTILE, DETECTION_VERSION)
+from utils.inference import InferenceService
+from utils.generate_reports import generate_all_reports, generate_png_report, PNG_REPORTS, REPORTS_VERSION
+from utils.artifact_cache import ArtifactCache, hash_file
+from utils.helper import allowed_file, cleanup_temp_folders_async, get_file_size, remove_folders
+from utils.state import SharedState
+from utils.retraining import (get_retrain_status, is_retraining_running, list_model_versions,
+                              resolve_model_folder, rollback_model_version, start_retraining_process)
+from utils.streaming import iter_file_chunks, iter_gzip, iter_csv_export, iter_zip_bundle, parse_export_filters
 
 app = Flask(__name__)
 CORS(app)
@@ -18,23 +34,296 @@ CORS(app)
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
 RESULTS_FOLDER = 'results'
-MODELS_FOLDER = 'models'
+MODELS_FOLDER = os.environ.get('MODELS_FOLDER', 'models')
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', 'cache')
 ALLOWED_EXTENSIONS = {'csv', 'txt'}
+COMPRESSIBLE_ARTIFACTS = {'raw_logs', 'features', 'anomalies'}
+EXPORTABLE_TABLES = {'features', 'anomalies'}
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', os.cpu_count() or 1))
+INFERENCE_BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_BATCH_WINDOW_MS', 5))
+INFERENCE_MAX_BATCH_ROWS = int(os.environ.get('INFERENCE_MAX_BATCH_ROWS', 65536))
+STATE_FILE = '.app_state.json'
+PREVIEW_STATE_FILE = '.preview_state.json'
+PREVIEW_SAMPLE_MB = float(os.environ.get('PREVIEW_SAMPLE_MB', 8))
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 50))
+ARTIFACT_STORE_QUOTA_MB = float(os.environ.get('ARTIFACT_STORE_QUOTA_MB', 2048))
+ARTIFACT_MAX_AGE_HOURS = float(os.environ.get('ARTIFACT_MAX_AGE_HOURS', 168))
+ARTIFACT_EVICTION_INTERVAL = float(os.environ.get('ARTIFACT_EVICTION_INTERVAL', 300))
+RETRAIN_MAX_ROWS = int(os.environ.get('RETRAIN_MAX_ROWS', 50000))
+RETRAIN_EPOCHS = int(os.environ.get('RETRAIN_EPOCHS', 30))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)  # Uploads are spooled to disk, not held in memory
 
-# Ensure folders exist
-for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER, MODELS_FOLDER]:
-    os.makedirs(folder, exist_ok=True)
-
-# Global state (cleared on restart)
-app_state = {
+# Global state shared by all serving workers (cleared on restart)
+app_state = SharedState(STATE_FILE, {
+    'upload_id': None,
     'uploaded_file': None,
+    'uploaded_files': [],
     'features_extracted': False,
     'detection_complete': False,
-    'reports_generated': False
-}
+    'reports_generated': False,
+    'run_keys': {}
+})
+
+# Progress of the background fast-preview job, shared by all serving workers
+preview_state = SharedState(PREVIEW_STATE_FILE, {
+    'job_id': None,
+    'state': 'idle',
+    'level': None,
+    'approximation': 0.0,
+    'estimated_remaining_seconds': None,
+    'users': 0,
+    'anomalies_detected': 0,
+    'top_anomalies': [],
+    'started_at': None,
+    'updated_at': None,
+    'error': None
+})
+
+# Spawned helper processes (extraction workers) re-import this module when the
+# app is run as a script; only the serving process prepares folders and state
+if multiprocessing.parent_process() is None:
+    for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER, MODELS_FOLDER]:
+        os.makedirs(folder, exist_ok=True)
+    
+    # Remove trash left behind by an interrupted background cleanup
+    threading.Thread(target=remove_folders, args=(glob.glob('*.trash-*'),), daemon=True).start()
+    
+    app_state.reset()
+    preview_state.reset()
+
+# Stage outputs keyed by input fingerprints (kept across uploads and restarts)
+artifact_cache = ArtifactCache(
+    CACHE_FOLDER,
+    quota_bytes=ARTIFACT_STORE_QUOTA_MB * 1024 * 1024,
+    max_age_seconds=ARTIFACT_MAX_AGE_HOURS * 3600,
+    eviction_interval=ARTIFACT_EVICTION_INTERVAL
+)
+
+# Shared micro-batching inference service (created on first detection)
+inference_service = None
+inference_service_lock = threading.Lock()
+
+# Models loaded ahead of the first detection, keyed by model version
+preloaded_models = {}
+
+def get_model_paths():
+    """Paths of the active Isolation Forest, autoencoder and scaler artifacts"""
+    model_folder = resolve_model_folder(MODELS_FOLDER)
+    return (
+        os.path.join(model_folder, 'isolation_forest.pkl'),
+        os.path.join(model_folder, 'autoencoder.keras'),
+        os.path.join(model_folder, 'scaler.pkl')
+    )
+
+def get_model_version(model_paths):
+    """Version of a model set, derived from the artifacts' modification times"""
+    return tuple(os.path.getmtime(p) for p in model_paths)
+
+def preload_models(include_autoencoder=True):
+    """
+    Load the model set ahead of the first detection.
+    
+    The serving master calls this with include_autoencoder=False: the scikit-learn
+    artifacts are shared copy-on-write by the forked workers, but TensorFlow
+    runtime state is not fork-safe, so each worker loads the autoencoder itself
+    after it has been forked.
+    """
+    model_paths = get_model_paths()
+    if not all(os.path.exists(p) for p in model_paths):
+        return None
+    
+    isolation_forest_path, autoencoder_path, scaler_path = model_paths
+    model_version = get_model_version(model_paths)
+    if model_version not in preloaded_models:
+        models = load_sklearn_models(isolation_forest_path, scaler_path)
+        # Keep the previous set until the new one has loaded
+        preloaded_models.clear()
+        preloaded_models[model_version] = models
+    
+    models = preloaded_models[model_version]
+    if include_autoencoder and 'autoencoder' not in models:
+        models['autoencoder'] = load_autoencoder(autoencoder_path)
+    
+    return model_version
+
+def get_inference_service():
+    """Return the shared inference service, reloading models if their files changed"""
+    global inference_service
+    
+    model_paths = get_model_paths()
+    model_version = get_model_version(model_paths)
+    
+    with inference_service_lock:
+        models = None
+        if inference_service is None or inference_service.model_version != model_version:
+            models = preloaded_models.get(model_version, {})
+            if 'autoencoder' not in models:
+                models = load_models(*model_paths)
+        
+        if inference_service is None:
+            inference_service = InferenceService(
+                models,
+                batch_window_ms=INFERENCE_BATCH_WINDOW_MS,
+                max_batch_rows=INFERENCE_MAX_BATCH_ROWS,
+                model_version=model_version
+            )
+        elif inference_service.model_version != model_version:
+            inference_service.swap_models(models, model_version)
+    
+    return inference_service
+
+def get_features_key_parts(input_paths):
+    """Inputs that fingerprint the feature extraction stage"""
+    return {'raw_logs': [hash_file(p) for p in input_paths], 'feature_version': FEATURE_VERSION}
+
+def run_features_stage(input_paths, output_path, compute=None, key_parts=None):
+    """Run the feature extraction stage, or restore it from the artifact store"""
+    return artifact_cache.run(
+        'features',
+        key_parts or get_features_key_parts(input_paths),
+        {'user_features_unsupervised.csv': output_path},
+        compute or (lambda: extract_features(input_paths, output_path, max_workers=EXTRACTION_WORKERS))
+    )
+
+def run_detection_stage(features_path, output_path):
+    """Run the detection stage, or restore it if features, models and thresholds are unchanged"""
+    model_paths = get_model_paths()
+    return artifact_cache.run(
+        'detection',
+        {
+            'features': hash_file(features_path),
+            'models': [hash_file(p) for p in model_paths],
+            'ae_threshold_percentile': AE_THRESHOLD_PERCENTILE,
+            'detection_version': DETECTION_VERSION
+        },
+        {'user_anomalies_with_reason.csv': output_path},
+        lambda: run_detection(features_path, *model_paths, output_path, inference_service=get_inference_service())
+    )
+
+def remove_png_reports():
+    """Delete rendered PNG charts so they are re-rendered from the latest results"""
+    for name in PNG_REPORTS:
+        try:
+            os.remove(os.path.join(RESULTS_FOLDER, f'{name}.png'))
+        except FileNotFoundError:
+            pass
+
+def run_preview_job(job_id, upload_id, input_paths):
+    """
+    Progressive detection: a sampled approximation first, refined to the exact result.
+    
+    Level 'sample' scores features estimated from randomly sampled log rows,
+    level 'partial' re-scores as a full chunked pass advances, and level
+    'exact' writes the final features/anomalies exactly like the regular
+    pipeline. A newer upload or reset (different job or upload id) stops the job.
+    
+    Everything is computed in a private folder. Uploads invalidate `upload_id`
+    before they replace any file, so a job that still owns its upload after
+    reading the logs has read the files it fingerprinted, and its results are
+    moved into the working folders under the app state lock.
+    """
+    features_path = os.path.join(PROCESSED_FOLDER, 'user_features_unsupervised.csv')
+    anomalies_path = os.path.join(RESULTS_FOLDER, 'user_anomalies_with_reason.csv')
+    work_folder = tempfile.mkdtemp(prefix=f'.preview-{job_id}-', dir=PROCESSED_FOLDER)
+    job_features_path = os.path.join(work_folder, 'user_features_unsupervised.csv')
+    job_anomalies_path = os.path.join(work_folder, 'user_anomalies_with_reason.csv')
+    preview_features_path = os.path.join(work_folder, 'preview_features.csv')
+    preview_anomalies_path = os.path.join(work_folder, 'preview_anomalies.csv')
+    model_paths = get_model_paths()
+    
+    def publish(features_df, level, fraction, remaining):
+        features_df.to_csv(preview_features_path, index=False)
+        results = run_detection(preview_features_path, *model_paths, preview_anomalies_path,
+                                inference_service=get_inference_service())
+        return preview_state.update({
+            'level': level,
+            'approximation': fraction,
+            'estimated_remaining_seconds': remaining,
+            'users': results['total_users'],
+            'anomalies_detected': results['combined']['anomalies_detected'],
+            'top_anomalies': results['top_anomalies'],
+            'updated_at': time.time()
+        }, expect={'job_id': job_id})
+    
+    def owns_upload():
+        return preview_state['job_id'] == job_id and app_state['upload_id'] == upload_id
+    
+    try:
+        merged = None
+        features_key_parts = get_features_key_parts(input_paths)
+        
+        # Logs seen before are restored from the artifact store without re-reading them
+        if not artifact_cache.contains('features', features_key_parts):
+            # Level 1: score a uniform sample of raw log rows, extrapolated per file
+            started = time.time()
+            frames, file_fractions, fraction = sample_log_rows(input_paths, PREVIEW_SAMPLE_MB * 1024 * 1024)
+            if fraction < 1.0 and any(len(df) for df in frames):
+                partials = [compute_partial_aggregates(df) for df in frames]
+                # Extrapolate the full pass from the sample's processing rate
+                remaining = (time.time() - started) * (1 - fraction) / fraction
+                if not publish(estimate_features(partials, file_fractions), 'sample', fraction, remaining):
+                    return
+            
+            # Level 2: refine while reading every row, then replace with the exact result
+            pass_started = time.time()
+            for fraction, file_partials, file_fractions in iter_progressive_partials(input_paths):
+                if preview_state['job_id'] != job_id:
+                    return
+                if fraction < 1.0:
+                    remaining = (time.time() - pass_started) * (1 - fraction) / fraction
+                    if not publish(estimate_features(file_partials, file_fractions), 'partial', fraction, remaining):
+                        return
+            merged = merge_partial_aggregates(file_partials)
+        
+        # Only results of the fingerprinted files may be stored under their key
+        if not owns_upload():
+            return
+        
+        def write_exact_features():
+            features_df = finalize_features(merged)
+            features_df.to_csv(job_features_path, index=False)
+            return build_extraction_stats(input_paths, file_partials, merged, features_df)
+        
+        _, _, features_key = run_features_stage(input_paths, job_features_path,
+                                                compute=write_exact_features if merged is not None else None,
+                                                key_parts=features_key_parts)
+        results, _, detection_key = run_detection_stage(job_features_path, job_anomalies_path)
+        
+        def commit(state):
+            if state['upload_id'] != upload_id or preview_state['job_id'] != job_id:
+                return None
+            # Charts rendered from the previous anomalies table are stale once it is replaced
+            remove_png_reports()
+            os.replace(job_features_path, features_path)
+            os.replace(job_anomalies_path, anomalies_path)
+            return {
+                'features_extracted': True,
+                'detection_complete': True,
+                'reports_generated': False,
+                'run_keys': {'features': features_key, 'detection': detection_key}
+            }
+        
+        if not app_state.apply(commit):
+            return
+        
+        preview_state.update({
+            'state': 'completed',
+            'level': 'exact',
+            'approximation': 1.0,
+            'estimated_remaining_seconds': 0.0,
+            'users': results['total_users'],
+            'anomalies_detected': results['combined']['anomalies_detected'],
+            'top_anomalies': results['top_anomalies'],
+            'updated_at': time.time()
+        }, expect={'job_id': job_id})
+        
+    except Exception as e:
+        preview_state.update({'state': 'failed', 'error': str(e), 'updated_at': time.time()}, expect={'job_id': job_id})
+    
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -46,45 +335,104 @@ def health_check():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload log file endpoint"""
+    """Upload one or more log files endpoint"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
+        files = request.files.getlist('file') + request.files.getlist('files')
         
-        file = request.files['file']
+        if not files:
+            return jsonify({'error': 'No file provided'}), 400
         
-        if file.filename == '':
+        if any(file.filename == '' for file in files):
             return jsonify({'error': 'No file selected'}), 400
         
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        if not all(allowed_file(file.filename, ALLOWED_EXTENSIONS) for file in files):
             return jsonify({'error': 'Invalid file type. Only CSV and TXT files allowed'}), 400
         
-        # Clean up previous uploads
-        cleanup_temp_folders([UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER])
-        
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_raw_logs.csv')
-        file.save(filepath)
+        # Invalidate the previous run first, so other workers and preview jobs stop using its files
+        app_state.update({
+            'upload_id': None,
+            'features_extracted': False,
+            'detection_complete': False,
+            'reports_generated': False,
+            'run_keys': {}
+        })
+        preview_state.reset()
+        
+        # Clear previous uploads; their stage outputs stay in the artifact store
+        cleanup_temp_folders_async([UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER])
+        
+        # Save uploaded files; a single upload keeps the historical raw log name
+        uploaded_files = []
+        for index, file in enumerate(files):
+            filename = secure_filename(file.filename)
+            if len(files) == 1:
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_raw_logs.csv')
+            else:
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'temp_raw_logs_{index:03d}.csv')
+            file.save(filepath)
+            uploaded_files.append({
+                'filename': filename,
+                'size': get_file_size(filepath),
+                'path': filepath
+            })
         
         # Update state
-        app_state['uploaded_file'] = filename
-        app_state['features_extracted'] = False
-        app_state['detection_complete'] = False
-        app_state['reports_generated'] = False
-        
-        file_size = get_file_size(filepath)
+        app_state.update({
+            'upload_id': uuid.uuid4().hex,
+            'uploaded_file': ', '.join(f['filename'] for f in uploaded_files),
+            'uploaded_files': uploaded_files
+        })
         
         return jsonify({
-            'message': 'File uploaded successfully',
-            'filename': filename,
-            'size': file_size,
-            'path': filepath
+            'message': f'{len(uploaded_files)} file(s) uploaded successfully',
+            'filename': app_state['uploaded_file'],
+            'size': uploaded_files[0]['size'] if len(uploaded_files) == 1 else None,
+            'path': uploaded_files[0]['path'] if len(uploaded_files) == 1 else None,
+            'files': uploaded_files
         }), 200
         
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Upload exceeds the {MAX_UPLOAD_MB:g} MB limit (MAX_UPLOAD_MB)'}), 413
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/preview', methods=['POST'])
+def start_preview():
+    """Start fast-preview detection on the uploaded logs, refining to exact in the background"""
+    try:
+        if not app_state['uploaded_file']:
+            return jsonify({'error': 'No file uploaded'}), 400
+        
+        upload_id = app_state['upload_id']
+        input_paths = [f['path'] for f in app_state['uploaded_files']]
+        
+        if not all(os.path.exists(p) for p in input_paths):
+            return jsonify({'error': 'Uploaded file not found'}), 404
+        
+        if not all(os.path.exists(p) for p in get_model_paths()):
+            return jsonify({'error': 'Model files not found. Please add models to the models/ folder'}), 404
+        
+        job_id = uuid.uuid4().hex
+        preview_state.reset()
+        preview_state.update({'job_id': job_id, 'state': 'running', 'started_at': time.time()})
+        
+        threading.Thread(target=run_preview_job, args=(job_id, upload_id, input_paths),
+                         name='preview-job', daemon=True).start()
+        
+        return jsonify({'message': 'Preview started', 'job_id': job_id}), 202
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/preview', methods=['GET'])
+def get_preview():
+    """Get the current preview approximation and its provisional top anomalies"""
+    return jsonify({key: preview_state[key] for key in [
+        'job_id', 'state', 'level', 'approximation', 'estimated_remaining_seconds',
+        'users', 'anomalies_detected', 'top_anomalies', 'started_at', 'updated_at', 'error'
+    ]})
+
 @app.route('/api/extract-features', methods=['POST'])
 def extract_features_endpoint():
     """Extract features from uploaded logs"""
@@ -92,21 +440,26 @@ def extract_features_endpoint():
         if not app_state['uploaded_file']:
             return jsonify({'error': 'No file uploaded'}), 400
         
-        input_path = os.path.join(UPLOAD_FOLDER, 'temp_raw_logs.csv')
+        uploaded_files = app_state['uploaded_files']
+        input_paths = [f['path'] for f in uploaded_files]
         output_path = os.path.join(PROCESSED_FOLDER, 'user_features_unsupervised.csv')
         
-        if not os.path.exists(input_path):
+        if not all(os.path.exists(p) for p in input_paths):
             return jsonify({'error': 'Uploaded file not found'}), 404
         
-        # Extract features
-        stats = extract_features(input_path, output_path)
+        # Extract features, aggregating log shards in parallel, unless these logs were seen before
+        stats, cached, key = run_features_stage(input_paths, output_path)
+        for file_stats, uploaded in zip(stats['files'], uploaded_files):
+            file_stats['filename'] = uploaded['filename']
         
         # Update state
         app_state['features_extracted'] = True
+        app_state['run_keys'] = {'features': key}
         
         return jsonify({
             'message': 'Features extracted successfully',
             'stats': stats,
+            'cached': cached,
             'output_path': output_path
         }), 200
         
@@ -127,28 +480,25 @@ def detect_anomalies():
             return jsonify({'error': 'Feature file not found'}), 404
         
         # Check if models exist
-        isolation_forest_path = os.path.join(MODELS_FOLDER, 'isolation_forest.pkl')
-        autoencoder_path = os.path.join(MODELS_FOLDER, 'autoencoder.keras')
-        scaler_path = os.path.join(MODELS_FOLDER, 'scaler.pkl')
+        isolation_forest_path, autoencoder_path, scaler_path = get_model_paths()
         
         if not all(os.path.exists(p) for p in [isolation_forest_path, autoencoder_path, scaler_path]):
             return jsonify({'error': 'Model files not found. Please add models to the models/ folder'}), 404
         
-        # Run detection
-        results = run_detection(
-            features_path,
-            isolation_forest_path,
-            autoencoder_path,
-            scaler_path,
-            output_path
-        )
+        # Charts rendered from the previous anomalies table are stale once it is replaced
+        remove_png_reports()
+        
+        # Run detection unless features, models and thresholds are unchanged
+        results, cached, key = run_detection_stage(features_path, output_path)
         
         # Update state
         app_state['detection_complete'] = True
+        app_state['run_keys'] = {'features': app_state['run_keys'].get('features'), 'detection': key}
         
         return jsonify({
             'message': 'Detection completed successfully',
-            'results': results
+            'results': results,
+            'cached': cached
         }), 200
         
     except Exception as e:
@@ -156,7 +506,7 @@ def detect_anomalies():
 
 @app.route('/api/generate-reports', methods=['POST'])
 def generate_reports():
-    """Generate visualization reports"""
+    """Generate reports: chart data JSON by default, PNG charts with mode=full"""
     try:
         if not app_state['detection_complete']:
             return jsonify({'error': 'Detection not completed yet'}), 400
@@ -167,48 +517,278 @@ def generate_reports():
         if not os.path.exists(anomalies_path):
             return jsonify({'error': 'Anomalies file not found'}), 404
         
-        # Generate all reports
-        report_files = generate_all_reports(
-            anomalies_path,
-            features_path,
-            RESULTS_FOLDER
+        body = request.get_json(silent=True) or {}
+        mode = body.get('mode', request.args.get('mode', 'data'))
+        if mode not in ('data', 'full'):
+            return jsonify({'error': "Invalid mode. Use 'data' or 'full'"}), 400
+        
+        # Generate all reports unless detection results are unchanged
+        report_names = ['chart_data.json', 'report_summary.json']
+        if mode == 'full':
+            report_names += [f'{name}.png' for name in PNG_REPORTS]
+        else:
+            # PNGs left from an earlier run are re-rendered on demand from these results
+            remove_png_reports()
+        
+        report_files, cached, key = artifact_cache.run(
+            'reports',
+            {
+                'anomalies': hash_file(anomalies_path),
+                'features': hash_file(features_path),
+                'mode': mode,
+                'reports_version': REPORTS_VERSION
+            },
+            {name: os.path.join(RESULTS_FOLDER, name) for name in report_names},
+            lambda: generate_all_reports(
+                anomalies_path,
+                features_path,
+                RESULTS_FOLDER,
+                mode=mode
+            )
         )
         
         # Update state
         app_state['reports_generated'] = True
+        app_state['run_keys'] = {**app_state['run_keys'], 'reports': key}
         
         return jsonify({
             'message': 'Reports generated successfully',
-            'files': report_files
+            'mode': mode,
+            'files': report_files,
+            'cached': cached
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_artifact_paths():
+    """Map downloadable artifact names to their paths"""
+    return {
+        'raw_logs': os.path.join(UPLOAD_FOLDER, 'temp_raw_logs.csv'),
+        'features': os.path.join(PROCESSED_FOLDER, 'user_features_unsupervised.csv'),
+        'anomalies': os.path.join(RESULTS_FOLDER, 'user_anomalies_with_reason.csv'),
+        'confusion_matrix': os.path.join(RESULTS_FOLDER, 'confusion_matrix.png'),
+        'feature_importance': os.path.join(RESULTS_FOLDER, 'feature_importance.png'),
+        'anomaly_distribution': os.path.join(RESULTS_FOLDER, 'anomaly_distribution.png'),
+        'model_comparison': os.path.join(RESULTS_FOLDER, 'model_comparison.png'),
+        'report_summary': os.path.join(RESULTS_FOLDER, 'report_summary.json'),
+        'chart_data': os.path.join(RESULTS_FOLDER, 'chart_data.json')
+    }
+
+def wants_gzip():
+    """Check whether the client accepts a gzip content-encoding"""
+    return request.accept_encodings['gzip'] > 0 and 'Range' not in request.headers
+
+def stream_response(chunks, filename, mimetype, compress):
+    """Build a streamed attachment response, gzip-encoded if requested"""
+    response = Response(iter_gzip(chunks) if compress else chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/api/download/<file_type>', methods=['GET'])
 def download_file(file_type):
-    """Download specific file"""
+    """Download specific file (CSV tables are gzip-encoded on the fly, ranges served as-is)"""
     try:
-        file_mapping = {
-            'raw_logs': os.path.join(UPLOAD_FOLDER, 'temp_raw_logs.csv'),
-            'features': os.path.join(PROCESSED_FOLDER, 'user_features_unsupervised.csv'),
-            'anomalies': os.path.join(RESULTS_FOLDER, 'user_anomalies_with_reason.csv'),
-            'confusion_matrix': os.path.join(RESULTS_FOLDER, 'confusion_matrix.png'),
-            'feature_importance': os.path.join(RESULTS_FOLDER, 'feature_importance.png'),
-            'anomaly_distribution': os.path.join(RESULTS_FOLDER, 'anomaly_distribution.png'),
-            'model_comparison': os.path.join(RESULTS_FOLDER, 'model_comparison.png'),
-            'report_summary': os.path.join(RESULTS_FOLDER, 'report_summary.json')
-        }
+        file_mapping = get_artifact_paths()
         
         if file_type not in file_mapping:
             return jsonify({'error': 'Invalid file type'}), 400
         
         file_path = file_mapping[file_type]
         
+        # A multi-file upload is downloaded one shard at a time (?shard=<index>)
+        uploaded_files = app_state['uploaded_files']
+        if file_type == 'raw_logs' and len(uploaded_files) > 1:
+            shard = request.args.get('shard', '')
+            if not shard.isdigit() or int(shard) >= len(uploaded_files):
+                return jsonify({
+                    'error': f'The upload has {len(uploaded_files)} files: pass ?shard=0..{len(uploaded_files) - 1}, '
+                             'or use /api/download-bundle for all of them',
+                    'files': [f['filename'] for f in uploaded_files]
+                }), 400
+            file_path = uploaded_files[int(shard)]['path']
+        
+        # PNG charts are rendered on demand when only chart data was generated
+        if not os.path.exists(file_path) and file_type in PNG_REPORTS and app_state['detection_complete']:
+            generate_png_report(file_type, file_mapping['anomalies'], file_mapping['features'], RESULTS_FOLDER)
+        
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'File not found'}), 404
+        
+        if file_type in COMPRESSIBLE_ARTIFACTS and wants_gzip():
+            return stream_response(iter_file_chunks(file_path), os.path.basename(file_path), 'text/csv', True)
+        
+        # send_file answers conditional and Range requests with 206 partial content
+        return send_file(file_path, as_attachment=True, conditional=True)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chart-data', methods=['GET'])
+def get_chart_data():
+    """Serve precomputed chart data for client-side rendering"""
+    try:
+        chart_data_path = get_artifact_paths()['chart_data']
+        
+        if not os.path.exists(chart_data_path):
+            return jsonify({'error': 'Reports not generated yet'}), 404
+        
+        return send_file(chart_data_path, mimetype='application/json')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    """Stream a filtered/projected CSV export of the features or anomalies table"""
+    try:
+        file_mapping = get_artifact_paths()
+        
+        if table not in EXPORTABLE_TABLES:
+            return jsonify({'error': 'Invalid table'}), 400
+        
+        file_path = file_mapping[table]
+        
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(file_path, as_attachment=True)
+        columns = [c for c in request.args.get('columns', '').split(',') if c]
+        try:
+            filters = parse_export_filters(request.args)
+            chunks = iter_csv_export(file_path, columns, filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return stream_response(chunks, f'{table}_export.csv', 'text/csv', wants_gzip())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/download-bundle', methods=['GET'])
+def download_bundle():
+    """Stream a zip bundle of every run artifact"""
+    try:
+        files = [(os.path.basename(path), path) for path in get_artifact_paths().values() if os.path.exists(path)]
+        files += [
+            (f"raw_logs/{f['filename']}", f['path'])
+            for f in app_state['uploaded_files']
+            if os.path.exists(f['path']) and f['path'] not in [path for _, path in files]
+        ]
+        
+        if not files:
+            return jsonify({'error': 'No artifacts available'}), 404
+        
+        response = Response(iter_zip_bundle(files), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=threat_detection_bundle.zip'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/inference-stats', methods=['GET'])
+def get_inference_stats():
+    """Get queue depth and batch-size metrics of the inference service"""
+    if inference_service is None:
+        return jsonify({'running': False}), 200
+    
+    return jsonify({'running': True, **inference_service.get_metrics()}), 200
+
+@app.route('/api/artifact-store', methods=['GET'])
+def get_artifact_store_stats():
+    """Get artifact store usage, eviction and cache hit/miss statistics"""
+    try:
+        return jsonify(artifact_cache.get_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/pin-run', methods=['POST'])
+def pin_run():
+    """Pin (or unpin with {"pinned": false}) the current run's artifacts against eviction"""
+    try:
+        run_keys = app_state['run_keys']
+        if not run_keys:
+            return jsonify({'error': 'No run to pin'}), 400
+        
+        body = request.get_json(silent=True) or {}
+        pinned = bool(body.get('pinned', True))
+        
+        updated = {stage: artifact_cache.set_pinned(stage, key, pinned) for stage, key in run_keys.items() if key}
+        
+        return jsonify({
+            'message': f"Run {'pinned' if pinned else 'unpinned'}",
+            'pinned': pinned,
+            'stages': updated
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/retrain', methods=['POST'])
+def start_retraining():
+    """Retrain the models on stored feature tables in a separate background process"""
+    try:
+        status = get_retrain_status(MODELS_FOLDER)
+        if is_retraining_running(status):
+            return jsonify({'error': 'Retraining already running'}), 409
+        
+        # Every feature table kept in the artifact store, plus the current one
+        feature_paths = glob.glob(os.path.join(CACHE_FOLDER, 'features', '*', 'user_features_unsupervised.csv'))
+        current_features = os.path.join(PROCESSED_FOLDER, 'user_features_unsupervised.csv')
+        if os.path.exists(current_features):
+            feature_paths.append(current_features)
+        
+        if not feature_paths:
+            return jsonify({'error': 'No stored feature tables to train on'}), 400
+        
+        body = request.get_json(silent=True) or {}
+        options = {
+            'activate': bool(body.get('activate', True)),
+            'max_training_rows': int(body.get('max_training_rows', RETRAIN_MAX_ROWS)),
+            'epochs': int(body.get('epochs', RETRAIN_EPOCHS))
+        }
+        
+        if start_retraining_process(MODELS_FOLDER, feature_paths, options) is None:
+            return jsonify({'error': 'Retraining already running'}), 409
+        
+        return jsonify({
+            'message': 'Retraining started',
+            'feature_tables': len(feature_paths),
+            'options': options
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/retrain/status', methods=['GET'])
+def get_retraining_status():
+    """Get the state and validation metrics of the latest retraining job"""
+    status = get_retrain_status(MODELS_FOLDER)
+    return jsonify({key: status[key] for key in ['state', 'started_at', 'finished_at', 'version', 'activated', 'metrics', 'error']})
+
+@app.route('/api/models/versions', methods=['GET'])
+def get_model_versions():
+    """List stored model versions and the activation history"""
+    try:
+        return jsonify(list_model_versions(MODELS_FOLDER)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/rollback', methods=['POST'])
+def rollback_models():
+    """Roll back to the previously active model version, or to {"version": ...}"""
+    try:
+        body = request.get_json(silent=True) or {}
+        try:
+            version = rollback_model_version(MODELS_FOLDER, body.get('version'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({'message': f'Model version {version} activated', 'version': version}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -221,19 +801,25 @@ def get_status():
         'features_extracted': app_state['features_extracted'],
         'detection_complete': app_state['detection_complete'],
         'reports_generated': app_state['reports_generated'],
-        'uploaded_filename': app_state['uploaded_file']
+        'uploaded_filename': app_state['uploaded_file'],
+        'uploaded_files': [f['filename'] for f in app_state['uploaded_files']],
+        'preview': {
+            'state': preview_state['state'],
+            'level': preview_state['level'],
+            'approximation': preview_state['approximation'],
+            'estimated_remaining_seconds': preview_state['estimated_remaining_seconds']
+        }
     })
 
 @app.route('/api/reset', methods=['POST'])
 def reset_state():
     """Reset all state and clean up files"""
     try:
-        cleanup_temp_folders([UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER])
+        # Invalidate the run before its folders are moved aside
+        app_state.reset()
+        preview_state.reset()
         
-        app_state['uploaded_file'] = None
-        app_state['features_extracted'] = False
-        app_state['detection_complete'] = False
-        app_state['reports_generated'] = False
+        cleanup_temp_folders_async([UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER])
         
         return jsonify({'message': 'State reset successfully'}), 200
         
@@ -262,8 +848,12 @@ def get_dashboard_stats():
             if os.path.exists(anomalies_path) and os.path.exists(features_path):
                 import pandas as pd
                 
-                anomalies_df = pd.read_csv(anomalies_path)
-                features_df = pd.read_csv(features_path)
+                try:
+                    anomalies_df = pd.read_csv(anomalies_path)
+                    features_df = pd.read_csv(features_path)
+                except FileNotFoundError:
+                    # A new upload moved the run aside after the state check
+                    return jsonify(stats), 200
                 
                 total_users = len(anomalies_df)
                 anomalies_detected = int(anomalies_df['combined_anomaly'].sum())
@@ -331,4 +921,5 @@ if __name__ == '__main__':
     print("  - isolation_forest.pkl")
     print("  - autoencoder.keras")
     print("  - scaler.pkl")
+    print("\nDevelopment server only - for production run: gunicorn -c gunicorn.conf.py")
     app.run(debug=True, host='0.0.0.0', port=5000)
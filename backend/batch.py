@@ -0,0 +1,176 @@
+"""
+Headless batch pipeline: extract features, run detection and generate reports
+for every log file in a directory or glob, without going through HTTP.
+
+Usage:
+    python batch.py /archive/logs --output-dir batch_results --workers 8
+    python batch.py "/archive/2024-*/*.csv" --report-mode full
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from utils.feature_extraction import extract_features
+from utils.run_detection import run_detection, load_models
+from utils.retraining import resolve_model_folder
+from utils.generate_reports import generate_all_reports
+from utils.helper import allowed_file, ensure_folder_exists
+
+ALLOWED_EXTENSIONS = {'csv', 'txt'}
+MODELS_FOLDER = 'models'
+
+# Model set loaded once per worker process
+_worker_models = None
+
+def _init_worker(model_paths):
+    """Load the model set once for this worker process"""
+    global _worker_models
+    _worker_models = load_models(*model_paths)
+
+def find_log_files(inputs, recursive=False):
+    """Expand directories and glob patterns into a sorted list of log files"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=True)
+        files.extend(f for f in candidates if os.path.isfile(f) and allowed_file(f, ALLOWED_EXTENSIONS))
+    return sorted(set(files))
+
+def process_log_file(input_path, output_folder, model_paths, report_mode):
+    """Run the full pipeline for one log file using this worker's model set"""
+    started = time.perf_counter()
+    ensure_folder_exists(output_folder)
+
+    features_path = os.path.join(output_folder, 'user_features_unsupervised.csv')
+    anomalies_path = os.path.join(output_folder, 'user_anomalies_with_reason.csv')
+
+    extraction_stats = extract_features(input_path, features_path, max_workers=1)
+    detection_stats = run_detection(features_path, *model_paths, anomalies_path, models=_worker_models)
+    generate_all_reports(anomalies_path, features_path, output_folder, mode=report_mode)
+
+    return {
+        'input': input_path,
+        'output_folder': output_folder,
+        'anomalies_path': anomalies_path,
+        'logs_processed': extraction_stats['total_logs_processed'],
+        'users': detection_stats['total_users'],
+        'anomalies': detection_stats['combined']['anomalies_detected'],
+        'seconds': time.perf_counter() - started
+    }
+
+def _output_folders(files, output_dir):
+    """
+    Give each input file its own output folder.
+
+    Folders mirror the files' paths relative to the inputs' common folder
+    (e.g. `sub/a.csv/`), which keeps them unique for same-named files in
+    different directories.
+    """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    return {path: os.path.join(output_dir, os.path.relpath(os.path.abspath(path), root)) for path in files}
+
+def merge_anomalies(results, output_path):
+    """Concatenate the per-file anomaly tables, tagging rows with their source file"""
+    output_dir = os.path.dirname(output_path)
+    tables = []
+    for result in results:
+        df = pd.read_csv(result['anomalies_path'])
+        # The output folder name is the file's unique relative path
+        df.insert(0, 'source_file', os.path.relpath(result['output_folder'], output_dir).replace(os.sep, '/'))
+        tables.append(df)
+
+    merged = pd.concat(tables, ignore_index=True)
+    merged.to_csv(output_path, index=False)
+    return merged
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='Log directories, files or glob patterns')
+    parser.add_argument('--output-dir', default='batch_results')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--models-dir', default=MODELS_FOLDER)
+    parser.add_argument('--report-mode', choices=['data', 'full'], default='data')
+    parser.add_argument('--recursive', action='store_true', help='Descend into subdirectories of input directories')
+    args = parser.parse_args()
+
+    files = find_log_files(args.inputs, args.recursive)
+    if not files:
+        print("No log files found")
+        return 1
+
+    # Follow the models/current symlink so batch runs score with the active (retrained) version
+    model_folder = resolve_model_folder(args.models_dir)
+    model_paths = (
+        os.path.join(model_folder, 'isolation_forest.pkl'),
+        os.path.join(model_folder, 'autoencoder.keras'),
+        os.path.join(model_folder, 'scaler.pkl')
+    )
+    missing = [p for p in model_paths if not os.path.exists(p)]
+    if missing:
+        print(f"Model files not found: {missing}")
+        return 1
+
+    ensure_folder_exists(args.output_dir)
+    folders = _output_folders(files, args.output_dir)
+    merged_path = os.path.join(args.output_dir, 'merged_anomalies.csv')
+    if merged_path in folders.values():
+        print(f"An input would get the output folder {merged_path}, which is reserved for the merged table")
+        return 1
+    workers = max(1, min(args.workers, len(files)))
+
+    print(f"Processing {len(files)} file(s) with {workers} worker(s) using models from {model_folder}...")
+    started = time.perf_counter()
+    results, failures = [], []
+
+    # Spawned workers each load their own model set once and keep it for every file they process
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(model_paths,)
+    ) as executor:
+        futures = {
+            executor.submit(process_log_file, path, folders[path], model_paths, args.report_mode): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                print(f"  [ok] {path}: {result['users']} users, {result['anomalies']} anomalies "
+                      f"({result['seconds']:.2f}s)")
+            except Exception as e:
+                failures.append(path)
+                print(f"  [failed] {path}: {e}")
+
+    elapsed = time.perf_counter() - started
+
+    if results:
+        results.sort(key=lambda r: r['input'])
+        merged = merge_anomalies(results, merged_path)
+        print(f"\nMerged anomalies table: {merged_path} ({int(merged['combined_anomaly'].sum())} anomalies)")
+
+    total_logs = sum(r['logs_processed'] for r in results)
+    total_users = sum(r['users'] for r in results)
+    print("\nThroughput summary")
+    print(f"  Files:        {len(results)} ok, {len(failures)} failed")
+    print(f"  Log rows:     {total_logs}")
+    print(f"  Users scored: {total_users}")
+    print(f"  Elapsed:      {elapsed:.2f}s")
+    print(f"  Files/s:      {len(results) / elapsed:.2f}")
+    print(f"  Log rows/s:   {total_logs / elapsed:.0f}")
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
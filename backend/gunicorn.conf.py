@@ -0,0 +1,130 @@
+"""
+Production serving configuration.
+
+Run from the backend folder with:
+
+    gunicorn -c gunicorn.conf.py
+
+The master process imports the app (scikit-learn and pandas) and loads the
+scikit-learn models once, then forks the workers, which share those pages
+copy-on-write. TensorFlow runtime state is not fork-safe, so it is imported
+only when each worker loads the Keras autoencoder after it is forked. When a model file
+changes, the master reloads the models and performs a rolling restart: new
+workers are forked from the refreshed master before the old ones are
+gracefully stopped.
+
+A model set that fails to load never takes the server down: the changed set
+is test-loaded in a separate process first, and a broken one is logged and
+left alone, so the current workers keep serving the models they have.
+"""
+import gc
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Seconds between model file checks in the master
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5))
+
+# Loads a whole model set (autoencoder included) in a throwaway process
+CHECK_MODELS_SCRIPT = 'import sys; from utils.run_detection import load_models; load_models(*sys.argv[1:])'
+
+def _models_loadable(server, model_paths):
+    """Test-load a model set without touching the master's state"""
+    try:
+        result = subprocess.run([sys.executable, '-c', CHECK_MODELS_SCRIPT, *model_paths],
+                                cwd=chdir, capture_output=True, text=True, timeout=300)
+    except subprocess.TimeoutExpired:
+        server.log.error("Loading the changed model set timed out; keeping the current workers")
+        return False
+
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ['unknown error'])[-1]
+        server.log.error(f"Changed model set can't be loaded, keeping the current workers: {error}")
+        return False
+    return True
+
+def _watch_models(server):
+    """Trigger a rolling restart once changed model files have settled and load"""
+    from app import get_model_paths, get_model_version
+
+    def current_version():
+        try:
+            return get_model_version(get_model_paths())
+        except OSError:
+            return None
+
+    # Last version acted on, so a broken set is reported once rather than every interval
+    loaded = current_version()
+    pending = None
+
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        version = current_version()
+
+        if version is None or version == loaded:
+            pending = None
+            continue
+
+        # Wait one more interval so a half-written model set is not picked up
+        if version != pending:
+            pending = version
+            continue
+
+        loaded = version
+        pending = None
+        if not _models_loadable(server, get_model_paths()):
+            continue
+
+        server.log.info("Model files changed, starting rolling restart")
+        os.kill(os.getpid(), signal.SIGHUP)
+
+def when_ready(server):
+    """Preload the scikit-learn models in the master and start watching the model files"""
+    from app import preload_models
+
+    try:
+        version = preload_models(include_autoencoder=False)
+        server.log.info(f"Preloaded model version: {version}")
+    except Exception:
+        server.log.exception("Could not preload the models; workers will retry on detection")
+
+    # Keep preloaded objects out of the cyclic GC so workers don't touch (and copy) their pages
+    gc.freeze()
+
+    threading.Thread(target=_watch_models, args=(server,), name='model-watcher', daemon=True).start()
+
+def on_reload(server):
+    """Refresh the preloaded models before new workers are forked"""
+    from app import preload_models
+
+    gc.unfreeze()
+    try:
+        version = preload_models(include_autoencoder=False)
+        server.log.info(f"Reloaded model version: {version}")
+    except Exception:
+        server.log.exception("Could not reload the models; keeping the previously preloaded set")
+    gc.freeze()
+
+def post_fork(server, worker):
+    """Load the autoencoder in the freshly forked worker, before it serves requests"""
+    from app import preload_models
+
+    try:
+        preload_models()
+    except Exception:
+        server.log.exception("Worker could not load the models; detection will retry")
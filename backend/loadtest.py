@@ -0,0 +1,393 @@
+"""
+Load-test harness for the backend HTTP API.
+
+Starts a local backend (dev server or gunicorn) with the bundled models, a
+given model folder, or a throwaway set trained on generated logs, and
+drives a realistic mix against it: many pollers on /api/status and
+/api/dashboard-stats plus occasional upload -> extract -> detect -> report
+runs on generated logs. Reports p50/p95/p99 latency, throughput and error
+rates per endpoint and the server's RSS, and saves machine-readable results.
+
+Each started server gets an empty temporary stage cache and every pipeline
+run uploads freshly generated logs, so runs measure real work rather than
+cache restores. The backend keeps a single global run (one upload, feature
+table and result set), so pipeline runners take turns: with several
+runners, runs are queued back to back instead of overwriting each other.
+
+Usage:
+    python loadtest.py --server gunicorn --pollers 32 --pipeline-runners 1 --duration 60 --output run.json
+    python loadtest.py --compare --duration 30 --train-models
+    python loadtest.py --diff baseline.json run.json
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_COMMANDS = {
+    'dev': [sys.executable, 'app.py'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+}
+
+POLL_ENDPOINTS = ['/api/status', '/api/dashboard-stats']
+
+ACTIONS = ['logon', 'logoff', 'file_open', 'file_copy', 'file_delete', 'email_send', 'email_read', 'http_visit']
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def generate_logs(path, n_users=500, n_rows=50000, seed=0):
+    """Write a synthetic raw log CSV with the columns feature extraction expects"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    users = [f'user{i:04d}' for i in range(n_users)]
+    # A few users behave unusually: off-hours, large files, many failures
+    unusual = set(rng.sample(users, max(1, n_users // 50)))
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user', 'timestamp', 'action', 'event_type', 'resource', 'status', 'file_size'])
+        for _ in range(n_rows):
+            user = rng.choice(users)
+            odd = user in unusual
+            hour = rng.choice([1, 2, 3, 22, 23]) if odd and rng.random() < 0.6 else rng.randint(8, 18)
+            timestamp = start + timedelta(days=rng.randint(0, 29), hours=hour, minutes=rng.randint(0, 59))
+            action = rng.choice(ACTIONS)
+            writer.writerow([
+                user,
+                timestamp.isoformat(sep=' '),
+                action,
+                action.split('_')[0],
+                f'res{rng.randint(0, 200)}',
+                'failure' if rng.random() < (0.3 if odd else 0.03) else 'success',
+                rng.randint(10_000_000, 500_000_000) if odd and action.startswith('file') else rng.randint(1_000, 2_000_000)
+            ])
+
+class EndpointStats:
+    """Thread-safe latency and error recorder, one series per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+        self._status_codes = {}
+
+    def record(self, endpoint, latency_ms, status):
+        with self._lock:
+            self._latencies.setdefault(endpoint, [])
+            self._errors.setdefault(endpoint, 0)
+            codes = self._status_codes.setdefault(endpoint, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+            if isinstance(status, int) and status < 400:
+                self._latencies[endpoint].append(latency_ms)
+            else:
+                self._errors[endpoint] += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            results = {}
+            for endpoint in sorted(self._latencies):
+                values = sorted(self._latencies[endpoint])
+                errors = self._errors[endpoint]
+                total = len(values) + errors
+                results[endpoint] = {
+                    'requests': total,
+                    'errors': errors,
+                    'error_rate': errors / total if total else 0.0,
+                    'throughput_rps': total / elapsed if elapsed else 0.0,
+                    'mean_ms': sum(values) / len(values) if values else 0.0,
+                    'p50_ms': percentile(values, 50),
+                    'p95_ms': percentile(values, 95),
+                    'p99_ms': percentile(values, 99),
+                    'max_ms': values[-1] if values else 0.0,
+                    'status_codes': dict(self._status_codes[endpoint])
+                }
+            return results
+
+def request(base_url, method, endpoint, stats, body=None, content_type=None, timeout=300):
+    """Send one request, record its latency and status, and return the status"""
+    req = urllib.request.Request(base_url + endpoint, data=body, method=method)
+    if content_type:
+        req.add_header('Content-Type', content_type)
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        status = type(e).__name__
+    stats.record(endpoint, (time.perf_counter() - started) * 1000.0, status)
+    return status
+
+def encode_multipart(field, filename, data):
+    """Encode a single file as a multipart/form-data body"""
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode('utf-8')
+    return head + data + f'\r\n--{boundary}--\r\n'.encode('utf-8'), f'multipart/form-data; boundary={boundary}'
+
+def poller(base_url, stats, stop, interval):
+    """Poll the status and dashboard endpoints like an open browser tab"""
+    while not stop.is_set():
+        for endpoint in POLL_ENDPOINTS:
+            request(base_url, 'GET', endpoint, stats, timeout=30)
+        stop.wait(interval * random.uniform(0.5, 1.5))
+
+def pipeline_runner(base_url, stats, stop, pipeline_lock, seeds, args):
+    """Run upload -> extract -> detect -> reports on new logs, then pause, until stopped"""
+    while not stop.is_set():
+        # Fresh logs every run, so no stage is restored from the cache
+        seed = next(seeds)
+        with tempfile.TemporaryDirectory(prefix='loadtest-') as tmp:
+            log_path = os.path.join(tmp, f'generated_logs_{seed}.csv')
+            generate_logs(log_path, args.log_users, args.log_rows, seed=seed)
+            with open(log_path, 'rb') as f:
+                body, content_type = encode_multipart('file', os.path.basename(log_path), f.read())
+
+        # The server holds one run at a time; concurrent runners would overwrite it mid-pipeline
+        with pipeline_lock:
+            for method, endpoint, payload, ctype in [
+                ('POST', '/api/upload', body, content_type),
+                ('POST', '/api/extract-features', None, None),
+                ('POST', '/api/detect', None, None),
+                ('POST', '/api/generate-reports', b'{"mode": "data"}', 'application/json')
+            ]:
+                if stop.is_set() or request(base_url, method, endpoint, stats, payload, ctype) != 200:
+                    break
+        stop.wait(args.pipeline_interval)
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)"""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+def rss_sampler(pid, samples, stop, interval=0.5):
+    """Sample the server's RSS until stopped"""
+    while not stop.is_set():
+        samples.append(process_tree_rss(pid))
+        stop.wait(interval)
+
+def train_models(models_folder, args, n_files=5):
+    """
+    Train a throwaway model set on generated logs into `models_folder`.
+
+    Uses the regular retraining job, so the set has the same features and
+    architecture the backend would produce itself.
+    """
+    from utils.feature_extraction import extract_features
+
+    feature_paths = []
+    for i in range(n_files):
+        log_path = os.path.join(models_folder, f'training_logs_{i}.csv')
+        feature_paths.append(os.path.join(models_folder, f'training_features_{i}.csv'))
+        # Seeds far from the pipeline runners' so the test logs are unseen
+        generate_logs(log_path, args.log_users, args.log_rows, seed=1_000_000 + i)
+        extract_features(log_path, feature_paths[-1], max_workers=1)
+        os.remove(log_path)
+
+    subprocess.run([sys.executable, '-m', 'utils.retraining', '--models-dir', models_folder, '--'] + feature_paths,
+                   cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    if not os.path.islink(os.path.join(models_folder, 'current')):
+        raise RuntimeError(f"Training produced no active model set (see {models_folder}/versions/retrain_status.json)")
+
+def start_server(server, base_url, cache_folder, models_folder=None, startup_timeout=120):
+    """Start a backend server in its own process group and wait until it is healthy"""
+    env = {**os.environ, 'CACHE_FOLDER': cache_folder}
+    if models_folder:
+        env['MODELS_FOLDER'] = os.path.abspath(models_folder)
+    process = subprocess.Popen(
+        SERVER_COMMANDS[server],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/api/health', timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.5)
+
+    stop_server(process)
+    raise RuntimeError(f"{server} server did not become healthy within {startup_timeout}s")
+
+def stop_server(process):
+    """Stop a server started by start_server, including its children"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+def run_scenario(base_url, args, server_pid=None):
+    """Drive the poller/pipeline mix for args.duration seconds and summarize it"""
+    stats = EndpointStats()
+    stop = threading.Event()
+    pipeline_lock = threading.Lock()
+    # Same log sequence for every scenario, so compared servers get the same work
+    seeds = itertools.count()
+    rss_samples = []
+
+    threads = [threading.Thread(target=poller, args=(base_url, stats, stop, args.poll_interval))
+               for _ in range(args.pollers)]
+    threads += [threading.Thread(target=pipeline_runner, args=(base_url, stats, stop, pipeline_lock, seeds, args))
+                for _ in range(args.pipeline_runners)]
+    if server_pid is not None:
+        threads.append(threading.Thread(target=rss_sampler, args=(server_pid, rss_samples, stop)))
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = stats.summary(elapsed)
+    total_requests = sum(e['requests'] for e in endpoints.values())
+    total_errors = sum(e['errors'] for e in endpoints.values())
+
+    return {
+        'elapsed_seconds': elapsed,
+        'total_requests': total_requests,
+        'total_errors': total_errors,
+        'throughput_rps': total_requests / elapsed if elapsed else 0.0,
+        'server_rss_bytes': {
+            'max': max(rss_samples) if rss_samples else None,
+            'mean': sum(rss_samples) / len(rss_samples) if rss_samples else None,
+            'samples': len(rss_samples)
+        },
+        'endpoints': endpoints
+    }
+
+def print_results(label, results):
+    """Print a per-endpoint latency table"""
+    rss = results['server_rss_bytes']
+    print(f"\n== {label} == {results['throughput_rps']:.1f} req/s, {results['total_errors']} errors", end='')
+    if rss['max'] is not None:
+        print(f", server RSS max {rss['max'] / 2**20:.0f} MB / mean {rss['mean'] / 2**20:.0f} MB")
+    else:
+        print()
+    print(f"{'endpoint':<26}{'reqs':>7}{'req/s':>9}{'err %':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, r in results['endpoints'].items():
+        print(f"{endpoint:<26}{r['requests']:>7}{r['throughput_rps']:>9.1f}{r['error_rate'] * 100:>8.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+def print_diff(baseline_path, candidate_path):
+    """Compare two saved result files endpoint by endpoint"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    for label in sorted(set(baseline['runs']) & set(candidate['runs'])):
+        base_run, cand_run = baseline['runs'][label], candidate['runs'][label]
+        print(f"\n== {label}: {base_run['throughput_rps']:.1f} -> {cand_run['throughput_rps']:.1f} req/s ==")
+        print(f"{'endpoint':<26}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'err %':>14}")
+        for endpoint in sorted(set(base_run['endpoints']) & set(cand_run['endpoints'])):
+            b, c = base_run['endpoints'][endpoint], cand_run['endpoints'][endpoint]
+            cells = ''.join(f"{b[k]:>8.1f} -> {c[k]:<6.1f}" for k in ['p50_ms', 'p95_ms', 'p99_ms'])
+            print(f"{endpoint:<26}{cells}{b['error_rate'] * 100:>5.1f} -> {c['error_rate'] * 100:<5.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='gunicorn')
+    parser.add_argument('--compare', action='store_true', help='Run the scenario against both the dev and gunicorn servers')
+    parser.add_argument('--no-start', action='store_true', help='Use an already running backend at --url')
+    parser.add_argument('--server-pid', type=int, help='PID to sample RSS from when using --no-start')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--pollers', type=int, default=16)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--pipeline-runners', type=int, default=1,
+                        help='Concurrent pipeline runners; their runs are serialized, the server holds one run at a time')
+    parser.add_argument('--pipeline-interval', type=float, default=5.0)
+    parser.add_argument('--log-users', type=int, default=500)
+    parser.add_argument('--log-rows', type=int, default=50000)
+    parser.add_argument('--models-dir', help='Serve the model set in this folder instead of the bundled models')
+    parser.add_argument('--train-models', action='store_true',
+                        help='Serve a throwaway model set trained on generated logs (5 files of --log-users/--log-rows)')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file')
+    parser.add_argument('--diff', nargs=2, metavar=('BASELINE', 'CANDIDATE'), help='Compare two saved result files')
+    args = parser.parse_args()
+
+    if args.diff:
+        print_diff(*args.diff)
+        return
+
+    runs = {}
+    if args.no_start:
+        runs['external'] = run_scenario(args.url, args, args.server_pid)
+    else:
+        with tempfile.TemporaryDirectory(prefix='loadtest-models-') as trained_folder:
+            models_folder = args.models_dir
+            if args.train_models:
+                print("Training a model set on generated logs...")
+                train_models(trained_folder, args)
+                models_folder = trained_folder
+
+            for server in (['dev', 'gunicorn'] if args.compare else [args.server]):
+                # Every server starts from an empty stage cache, leaving the persistent one untouched
+                with tempfile.TemporaryDirectory(prefix='loadtest-cache-') as cache_folder:
+                    process = start_server(server, args.url, cache_folder, models_folder)
+                    try:
+                        runs[server] = run_scenario(args.url, args, process.pid)
+                    finally:
+                        stop_server(process)
+
+    for label, results in runs.items():
+        print_results(label, results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(),
+                'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+                'config': {k: v for k, v in vars(args).items() if k not in ('diff', 'output')},
+                'runs': runs
+            }, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
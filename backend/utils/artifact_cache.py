@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from utils.state import SharedState
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# File hashes memoized by (path, size, mtime) so unchanged models aren't rehashed per request
+_hash_memo = {}
+_hash_memo_lock = threading.Lock()
+
+def hash_file(file_path):
+    """SHA-256 of a file's contents, memoized on its size and modification time"""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    with _hash_memo_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    with _hash_memo_lock:
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+def fingerprint(stage, key_parts):
+    """Fingerprint a pipeline stage from a JSON-serializable description of its inputs"""
+    payload = json.dumps({'stage': stage, 'inputs': key_parts}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Hit/miss (per stage) and eviction counters, shared through `<root>/.stats.json`
+STATS_DEFAULTS = {'hits': {}, 'misses': {}, 'evictions': 0, 'bytes_evicted': 0, 'last_eviction_at': None}
+
+class ArtifactCache:
+    """
+    Managed store of pipeline stage outputs keyed by input fingerprints.
+
+    Each entry is a folder `<root>/<stage>/<fingerprint>/` holding the stage's
+    output files and a `meta.json` with the stage result. Cached files are
+    copied (never linked) into place, so later writes to the working folders
+    can't corrupt an entry.
+
+    The store is kept under `quota_bytes` by a background thread that evicts
+    entries not accessed for `max_age_seconds`, then least recently used ones.
+    Entries with a `pinned` marker are never evicted. Hit, miss and eviction
+    counters are kept in the store itself, so every serving worker reports the
+    same totals.
+    """
+
+    def __init__(self, root, quota_bytes=None, max_age_seconds=None, eviction_interval=300):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.eviction_interval = eviction_interval
+        os.makedirs(root, exist_ok=True)
+
+        self._stats = SharedState(os.path.join(root, '.stats.json'), STATS_DEFAULTS)
+        self._eviction_requested = threading.Event()
+        self._evictor_lock = threading.Lock()
+        self._evictor_pid = None
+
+    def entry_path(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def load(self, stage, key, outputs):
+        """Restore a cached entry's files to `outputs` (name -> path) and return its result"""
+        self._ensure_evictor()
+        entry = self.entry_path(stage, key)
+        meta_path = os.path.join(entry, 'meta.json')
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if set(meta['outputs']) != set(outputs):
+                return None
+            for name, dest in outputs.items():
+                shutil.copyfile(os.path.join(entry, name), dest)
+            os.utime(meta_path)  # record the access for LRU eviction
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return meta['result']
+
+    def store(self, stage, key, outputs, result):
+        """Store a stage's output files and result under its fingerprint"""
+        entry = self.entry_path(stage, key)
+        stage_folder = os.path.dirname(entry)
+        os.makedirs(stage_folder, exist_ok=True)
+
+        tmp_entry = tempfile.mkdtemp(dir=stage_folder, prefix='.tmp-')
+        try:
+            for name, src in outputs.items():
+                shutil.copyfile(src, os.path.join(tmp_entry, name))
+            with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+                json.dump({
+                    'stage': stage,
+                    'created_at': time.time(),
+                    'outputs': sorted(outputs),
+                    'result': result
+                }, f, default=str)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another request stored the same fingerprint first, or the disk is full
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.request_eviction()
+
+    def run(self, stage, key_parts, outputs, compute):
+        """
+        Return (result, cached, key) for a stage, computing it only on a fingerprint miss.
+
+        `outputs` maps cache file names to the working paths the stage writes.
+        """
+        key = fingerprint(stage, key_parts)
+
+        result = self.load(stage, key, outputs)
+        self._count('hits' if result is not None else 'misses', stage)
+        if result is not None:
+            return result, True, key
+
+        result = compute()
+        self.store(stage, key, outputs, result)
+        return result, False, key
+
+    def contains(self, stage, key_parts):
+        """Check whether a stage result with this fingerprint is stored"""
+        return os.path.exists(os.path.join(self.entry_path(stage, fingerprint(stage, key_parts)), 'meta.json'))
+
+    def set_pinned(self, stage, key, pinned):
+        """Pin or unpin an entry; pinned entries are never evicted"""
+        entry = self.entry_path(stage, key)
+        marker = os.path.join(entry, 'pinned')
+
+        if not os.path.isdir(entry):
+            return False
+        if pinned:
+            open(marker, 'a').close()
+        elif os.path.exists(marker):
+            os.unlink(marker)
+        return True
+
+    def _count(self, kind, stage):
+        self._stats.apply(lambda stats: {kind: {**stats[kind], stage: stats[kind].get(stage, 0) + 1}})
+
+    def list_entries(self):
+        """Scan the store and describe every entry"""
+        entries = []
+        for stage in os.listdir(self.root):
+            stage_folder = os.path.join(self.root, stage)
+            if stage.startswith('.') or not os.path.isdir(stage_folder):
+                continue
+            for key in os.listdir(stage_folder):
+                entry = os.path.join(stage_folder, key)
+                if key.startswith('.'):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+                    last_access = os.stat(os.path.join(entry, 'meta.json')).st_mtime
+                except OSError:
+                    continue
+                entries.append({
+                    'stage': stage,
+                    'key': key,
+                    'size': size,
+                    'last_access': last_access,
+                    'pinned': os.path.exists(os.path.join(entry, 'pinned'))
+                })
+        return entries
+
+    def _remove_entry(self, entry):
+        """Remove an entry, renaming it aside first so readers never see it half-deleted"""
+        path = self.entry_path(entry['stage'], entry['key'])
+        doomed = os.path.join(os.path.dirname(path), f".evicted-{entry['key']}")
+        try:
+            os.rename(path, doomed)
+        except OSError:
+            return False
+        shutil.rmtree(doomed, ignore_errors=True)
+        return True
+
+    def evict(self):
+        """Evict expired entries, then least recently used ones until under quota"""
+        entries = self.list_entries()
+        now = time.time()
+        evicted = []
+
+        candidates = sorted((e for e in entries if not e['pinned']), key=lambda e: e['last_access'])
+        total = sum(e['size'] for e in entries)
+
+        for entry in candidates:
+            expired = self.max_age_seconds is not None and now - entry['last_access'] > self.max_age_seconds
+            over_quota = self.quota_bytes is not None and total > self.quota_bytes
+            if not (expired or over_quota):
+                continue
+            if self._remove_entry(entry):
+                total -= entry['size']
+                evicted.append(entry)
+
+        self._stats.apply(lambda stats: {
+            'evictions': stats['evictions'] + len(evicted),
+            'bytes_evicted': stats['bytes_evicted'] + sum(e['size'] for e in evicted),
+            'last_eviction_at': now
+        })
+
+        return evicted
+
+    def _ensure_evictor(self):
+        """
+        Start the background evictor in this process on first use.
+
+        Threads don't survive fork, so each serving worker starts its own. The
+        first pass runs right away, so expired entries are evicted after a
+        restart even if every request is a cache hit.
+        """
+        if self._evictor_pid == os.getpid():
+            return
+        with self._evictor_lock:
+            if self._evictor_pid == os.getpid():
+                return
+            self._evictor_pid = os.getpid()
+        self._eviction_requested.set()
+        threading.Thread(target=self._eviction_loop, name='artifact-evictor', daemon=True).start()
+
+    def request_eviction(self):
+        """Wake the background evictor, starting it in this process if needed"""
+        self._ensure_evictor()
+        self._eviction_requested.set()
+
+    def _eviction_loop(self):
+        while True:
+            self._eviction_requested.wait(self.eviction_interval)
+            self._eviction_requested.clear()
+            try:
+                self.evict()
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """Report usage, quota and hit/miss statistics"""
+        entries = self.list_entries()
+        stats = {key: self._stats[key] for key in STATS_DEFAULTS}
+
+        hits = sum(stats['hits'].values())
+        misses = sum(stats['misses'].values())
+        stats.update({
+            'entries': len(entries),
+            'pinned_entries': sum(1 for e in entries if e['pinned']),
+            'bytes_used': sum(e['size'] for e in entries),
+            'quota_bytes': self.quota_bytes,
+            'max_age_seconds': self.max_age_seconds,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0
+        })
+        return stats
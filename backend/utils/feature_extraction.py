@@ -1,115 +1,279 @@
 import pandas as pd
 import numpy as np
+import os
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import warnings
 warnings.filterwarnings('ignore')
 
-def extract_features(input_csv_path, output_csv_path):
+# Bump whenever extraction logic changes so cached feature tables are invalidated
+FEATURE_VERSION = '2'
+
+# Exact column order of the user feature table
+FEATURE_COLUMNS = [
+    'user', 'total_events', 'unique_event_types', 'unique_actions',
+    'avg_file_size', 'max_file_size', 'success_rate', 'offhour_activity_ratio',
+    'failed_actions', 'file_actions', 'email_actions', 'logon_actions', 'logoff_actions'
+]
+
+# Additive per-user counters kept in a partial aggregate
+PARTIAL_SUM_COLUMNS = [
+    'total_events', 'file_size_sum', 'file_size_count', 'success_count', 'status_events',
+    'offhour_count', 'file_actions', 'email_actions', 'logon_actions', 'logoff_actions'
+]
+
+def compute_partial_aggregates(df):
+    """
+    Compute mergeable per-user aggregates from a raw log DataFrame.
+
+    Counters are additive across shards; distinct event types and actions are kept
+    as (user, value) pairs so unique counts stay exact after merging.
+    """
+    # Ensure required columns exist
+    required_cols = ['user']
+    if not all(col in df.columns for col in required_cols):
+        raise ValueError(f"Input CSV must contain at least: {required_cols}")
+
+    df = df[df['user'].notna()]
+
+    counters = pd.DataFrame({'user': df['user'], 'total_events': 1}, index=df.index)
+    for col in PARTIAL_SUM_COLUMNS[1:]:
+        counters[col] = 0
+    counters['file_size_sum'] = 0.0
+    counters['file_size_max'] = np.nan
+
+    # Action-based counters
+    if 'action' in df.columns:
+        action_lower = df['action'].str.lower()
+        counters['file_actions'] = action_lower.str.contains('file', na=False).astype(int)
+        counters['email_actions'] = action_lower.str.contains('email', na=False).astype(int)
+        counters['logon_actions'] = action_lower.str.contains('logon|login', na=False).astype(int)
+        counters['logoff_actions'] = action_lower.str.contains('logoff|logout', na=False).astype(int)
+
+    # File size counters
+    if 'file_size' in df.columns:
+        file_size = pd.to_numeric(df['file_size'], errors='coerce')
+        counters['file_size_sum'] = file_size.fillna(0.0)
+        counters['file_size_count'] = file_size.notna().astype(int)
+        counters['file_size_max'] = file_size
+
+    # Success counters
+    if 'status' in df.columns:
+        counters['success_count'] = (df['status'].str.lower() == 'success').astype(int)
+        counters['status_events'] = 1
+
+    # Off-hour counters
+    timestamps = None
+    if 'timestamp' in df.columns:
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce')
+        hour = timestamps.dt.hour
+        counters['offhour_count'] = ((hour < 6) | (hour > 18)).astype(int)
+
+    grouped = counters.groupby('user', sort=False)
+    sums = grouped[PARTIAL_SUM_COLUMNS].sum()
+    sums['file_size_max'] = grouped['file_size_max'].max()
+
+    distinct = {}
+    for col in ['event_type', 'action']:
+        if col in df.columns:
+            distinct[col] = df[['user', col]].dropna().drop_duplicates()
+        else:
+            distinct[col] = pd.DataFrame(columns=['user', col])
+
+    return {
+        'sums': sums,
+        'distinct': distinct,
+        'rows': len(df),
+        'timestamp_min': timestamps.min() if timestamps is not None else None,
+        'timestamp_max': timestamps.max() if timestamps is not None else None,
+        'has_timestamp': timestamps is not None
+    }
+
+def merge_partial_aggregates(partials):
+    """Merge partial aggregates from several shards into one"""
+    sums = pd.concat([p['sums'] for p in partials])
+    grouped = sums.groupby(level=0, sort=False)
+    merged_sums = grouped[PARTIAL_SUM_COLUMNS].sum()
+    merged_sums['file_size_max'] = grouped['file_size_max'].max()
+
+    distinct = {}
+    for col in ['event_type', 'action']:
+        distinct[col] = pd.concat([p['distinct'][col] for p in partials]).drop_duplicates()
+
+    timed = [p for p in partials if p['has_timestamp']]
+
+    return {
+        'sums': merged_sums,
+        'distinct': distinct,
+        'rows': sum(p['rows'] for p in partials),
+        'timestamp_min': pd.Series([p['timestamp_min'] for p in timed], dtype='datetime64[ns]').min() if timed else None,
+        'timestamp_max': pd.Series([p['timestamp_max'] for p in timed], dtype='datetime64[ns]').max() if timed else None,
+        'has_timestamp': bool(timed)
+    }
+
+def finalize_features(partial):
+    """Turn a (merged) partial aggregate into the user feature table"""
+    sums = partial['sums']
+    total = sums['total_events']
+
+    features_df = pd.DataFrame(index=sums.index)
+    features_df['total_events'] = total.astype(int)
+
+    for col, feature in [('event_type', 'unique_event_types'), ('action', 'unique_actions')]:
+        counts = partial['distinct'][col].groupby('user').size()
+        features_df[feature] = counts.reindex(sums.index, fill_value=0).astype(int)
+
+    features_df['avg_file_size'] = (sums['file_size_sum'] / sums['file_size_count'].replace(0, np.nan)).fillna(0.0)
+    features_df['max_file_size'] = sums['file_size_max'].fillna(0.0).astype(float)
+    features_df['success_rate'] = (sums['success_count'] / total).astype(float)
+    features_df['offhour_activity_ratio'] = (sums['offhour_count'] / total).astype(float)
+    features_df['failed_actions'] = (sums['status_events'] - sums['success_count']).astype(int)
+
+    for col in ['file_actions', 'email_actions', 'logon_actions', 'logoff_actions']:
+        features_df[col] = sums[col].astype(int)
+
+    features_df = features_df.rename_axis('user').reset_index()
+    return features_df[FEATURE_COLUMNS]
+
+def _format_date_range(partial):
+    """Format the timestamp range of a partial aggregate"""
+    if not partial['has_timestamp']:
+        return {'start': None, 'end': None}
+    return {
+        'start': partial['timestamp_min'].isoformat(),
+        'end': partial['timestamp_max'].isoformat()
+    }
+
+def build_extraction_stats(input_paths, partials, merged, features_df):
+    """Extraction statistics with a per-file breakdown"""
+    return {
+        'total_users': len(features_df),
+        'total_logs_processed': merged['rows'],
+        'features_extracted': len(FEATURE_COLUMNS) - 1,
+        'feature_names': FEATURE_COLUMNS[1:],
+        'date_range': _format_date_range(merged),
+        'files': [
+            {
+                'filename': os.path.basename(path),
+                'logs_processed': partial['rows'],
+                'users': len(partial['sums']),
+                'date_range': _format_date_range(partial)
+            }
+            for path, partial in zip(input_paths, partials)
+        ]
+    }
+
+def extract_partial_from_file(input_csv_path):
+    """Read one raw log file and return its partial aggregate"""
+    try:
+        df = pd.read_csv(input_csv_path)
+        return compute_partial_aggregates(df)
+    except Exception as e:
+        raise Exception(f"{os.path.basename(input_csv_path)}: {str(e)}")
+
+# Seconds an unused extraction pool is kept before its workers are stopped
+EXTRACTION_POOL_IDLE_SECONDS = 300
+
+# Long-lived pool of spawned extraction workers, created on first use in each process
+_extraction_pool = None
+_extraction_pool_key = None
+_extraction_pool_users = 0
+_extraction_pool_timer = None
+_extraction_pool_lock = threading.Lock()
+
+@contextmanager
+def extraction_pool(max_workers):
+    """
+    Use the shared extraction worker pool, creating it if needed.
+
+    Workers are spawned rather than forked: the serving process runs inference,
+    eviction and preview threads, and forking it can deadlock the children on
+    locks those threads hold. Spawning is slow, so the pool is reused, and its
+    workers are stopped once it has been idle for EXTRACTION_POOL_IDLE_SECONDS.
+    """
+    global _extraction_pool, _extraction_pool_key, _extraction_pool_users, _extraction_pool_timer
+
+    key = (os.getpid(), max_workers)
+    with _extraction_pool_lock:
+        if _extraction_pool_timer is not None:
+            _extraction_pool_timer.cancel()
+            _extraction_pool_timer = None
+        if _extraction_pool_key != key:
+            # A pool inherited through fork has no live workers in this process
+            if _extraction_pool is not None and _extraction_pool_key[0] == os.getpid():
+                _extraction_pool.shutdown(wait=False)
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _extraction_pool_key = key
+            _extraction_pool_users = 0
+        pool = _extraction_pool
+        _extraction_pool_users += 1
+
+    try:
+        yield pool
+    except BrokenProcessPool:
+        _discard_extraction_pool(pool)
+        raise
+    finally:
+        with _extraction_pool_lock:
+            if _extraction_pool is pool:
+                _extraction_pool_users -= 1
+                if _extraction_pool_users == 0:
+                    _extraction_pool_timer = threading.Timer(EXTRACTION_POOL_IDLE_SECONDS, _discard_extraction_pool, args=(pool, True))
+                    _extraction_pool_timer.daemon = True
+                    _extraction_pool_timer.start()
+
+def _discard_extraction_pool(pool, only_if_idle=False):
+    """Stop a broken (or still idle) pool so the next extraction starts a fresh one"""
+    global _extraction_pool, _extraction_pool_key, _extraction_pool_timer
+
+    with _extraction_pool_lock:
+        if _extraction_pool is not pool or (only_if_idle and _extraction_pool_users):
+            return
+        _extraction_pool = None
+        _extraction_pool_key = None
+        _extraction_pool_timer = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_features(input_csv_path, output_csv_path, max_workers=None):
     """
     Extract features from raw log data for unsupervised anomaly detection.
-    
+
     Expected input columns: user, timestamp, action, resource, status, file_size, etc.
-    
+    `input_csv_path` may be a single path or a list of log shards; shards are
+    aggregated in parallel (spawned) worker processes and merged into one user table.
+
     Returns statistics about the extraction process.
     """
     try:
-        # Read raw logs
-        df = pd.read_csv(input_csv_path)
-        
-        # Ensure required columns exist
-        required_cols = ['user']
-        if not all(col in df.columns for col in required_cols):
-            raise ValueError(f"Input CSV must contain at least: {required_cols}")
-        
-        # Convert timestamp if exists
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            df['hour'] = df['timestamp'].dt.hour
-        
-        # Group by user and extract features
-        user_features = []
-        
-        for user in df['user'].unique():
-            user_df = df[df['user'] == user]
-            
-            # Initialize features with exact column names
-            features = {
-                'user': user,
-                'total_events': len(user_df),
-                'unique_event_types': 0,
-                'unique_actions': 0,
-                'avg_file_size': 0.0,
-                'max_file_size': 0.0,
-                'success_rate': 0.0,
-                'offhour_activity_ratio': 0.0,
-                'failed_actions': 0,
-                'file_actions': 0,
-                'email_actions': 0,
-                'logon_actions': 0,
-                'logoff_actions': 0
-            }
-            
-            # Event types
-            if 'event_type' in df.columns:
-                features['unique_event_types'] = user_df['event_type'].nunique()
-            
-            # Action-based features
-            if 'action' in df.columns:
-                features['unique_actions'] = user_df['action'].nunique()
-                action_lower = user_df['action'].str.lower()
-                
-                # Count specific action types
-                features['file_actions'] = action_lower.str.contains('file', na=False).sum()
-                features['email_actions'] = action_lower.str.contains('email', na=False).sum()
-                features['logon_actions'] = action_lower.str.contains('logon|login', na=False).sum()
-                features['logoff_actions'] = action_lower.str.contains('logoff|logout', na=False).sum()
-            
-            # File size features
-            if 'file_size' in df.columns:
-                file_sizes = user_df['file_size'].dropna()
-                if len(file_sizes) > 0:
-                    features['avg_file_size'] = float(file_sizes.mean())
-                    features['max_file_size'] = float(file_sizes.max())
-            
-            # Success rate
-            if 'status' in df.columns:
-                success_count = (user_df['status'].str.lower() == 'success').sum()
-                features['success_rate'] = float(success_count / len(user_df)) if len(user_df) > 0 else 0.0
-                features['failed_actions'] = len(user_df) - success_count
-            
-            # Off-hour activity ratio
-            if 'timestamp' in df.columns and 'hour' in user_df.columns:
-                offhour_count = len(user_df[(user_df['hour'] < 6) | (user_df['hour'] > 18)])
-                features['offhour_activity_ratio'] = float(offhour_count / len(user_df)) if len(user_df) > 0 else 0.0
-            
-            user_features.append(features)
-        
-        # Create DataFrame with exact column order
-        column_order = [
-            'user', 'total_events', 'unique_event_types', 'unique_actions',
-            'avg_file_size', 'max_file_size', 'success_rate', 'offhour_activity_ratio',
-            'failed_actions', 'file_actions', 'email_actions', 'logon_actions', 'logoff_actions'
-        ]
-        
-        features_df = pd.DataFrame(user_features)
-        features_df = features_df[column_order]
-        
+        input_paths = [input_csv_path] if isinstance(input_csv_path, str) else list(input_csv_path)
+        if not input_paths:
+            raise ValueError("No input files provided")
+
+        # Aggregate each shard, in parallel when there is more than one
+        pool_size = max_workers or os.cpu_count() or 1
+        if min(pool_size, len(input_paths)) > 1:
+            with extraction_pool(pool_size) as pool:
+                partials = list(pool.map(extract_partial_from_file, input_paths))
+        else:
+            partials = [extract_partial_from_file(path) for path in input_paths]
+
+        merged = merge_partial_aggregates(partials) if len(partials) > 1 else partials[0]
+        features_df = finalize_features(merged)
+
         # Save to CSV
         features_df.to_csv(output_csv_path, index=False)
-        
+
         # Calculate statistics
-        stats = {
-            'total_users': len(features_df),
-            'total_logs_processed': len(df),
-            'features_extracted': len(column_order) - 1,
-            'feature_names': column_order[1:],
-            'date_range': {
-                'start': df['timestamp'].min().isoformat() if 'timestamp' in df.columns else None,
-                'end': df['timestamp'].max().isoformat() if 'timestamp' in df.columns else None
-            }
-        }
-        
+        stats = build_extraction_stats(input_paths, partials, merged, features_df)
+
         return stats
-        
+
     except Exception as e:
         raise Exception(f"Feature extraction failed: {str(e)}")
@@ -1,13 +1,20 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
 import json
 import os
+import threading
 from datetime import datetime
 import warnings
 warnings.filterwarnings('ignore')
 
+from utils.helper import format_top_anomalies
+
+# Bump whenever report contents change so cached reports are invalidated
+REPORTS_VERSION = '2'
+
 # Set style
 sns.set_style("darkgrid")
 plt.rcParams['figure.facecolor'] = '#0F172A'
@@ -17,6 +24,17 @@ plt.rcParams['axes.labelcolor'] = '#E2E8F0'
 plt.rcParams['xtick.color'] = '#E2E8F0'
 plt.rcParams['ytick.color'] = '#E2E8F0'
 
+def _save_figure(fig, output_path):
+    """
+    Save a figure, replacing any existing file atomically.
+
+    Charts are drawn on standalone Figure objects rather than pyplot's global
+    current figure, so request threads can render concurrently.
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fig.savefig(tmp_path, dpi=150, facecolor='#0F172A', format='png')
+    os.replace(tmp_path, output_path)
+
 def generate_confusion_matrix(anomalies_df, output_folder):
     """Generate confusion matrix visualization"""
     try:
@@ -35,7 +53,8 @@ def generate_confusion_matrix(anomalies_df, output_folder):
         
         confusion_matrix = np.array([[tn, fp], [fn, tp]])
         
-        fig, ax = plt.subplots(figsize=(8, 6))
+        fig = Figure(figsize=(8, 6))
+        ax = fig.subplots()
         sns.heatmap(confusion_matrix, annot=True, fmt='d', cmap='Blues', 
                     xticklabels=['Normal', 'Anomaly'],
                     yticklabels=['Normal', 'Anomaly'],
@@ -45,10 +64,9 @@ def generate_confusion_matrix(anomalies_df, output_folder):
         ax.set_ylabel('True Label', fontsize=12, color='#E2E8F0')
         ax.set_title('Confusion Matrix - Combined Model', fontsize=14, fontweight='bold', color='#E2E8F0')
         
-        plt.tight_layout()
+        fig.tight_layout()
         output_path = os.path.join(output_folder, 'confusion_matrix.png')
-        plt.savefig(output_path, dpi=150, facecolor='#0F172A')
-        plt.close()
+        _save_figure(fig, output_path)
         
         return output_path
         
@@ -68,7 +86,8 @@ def generate_feature_importance(features_df, output_folder):
         importance = variances / variances.sum()
         importance = importance.sort_values(ascending=True).tail(15)
         
-        fig, ax = plt.subplots(figsize=(10, 8))
+        fig = Figure(figsize=(10, 8))
+        ax = fig.subplots()
         importance.plot(kind='barh', ax=ax, color='#2563EB')
         
         ax.set_xlabel('Importance Score', fontsize=12, color='#E2E8F0')
@@ -76,10 +95,9 @@ def generate_feature_importance(features_df, output_folder):
         ax.set_title('Top 15 Feature Importance', fontsize=14, fontweight='bold', color='#E2E8F0')
         ax.grid(True, alpha=0.3)
         
-        plt.tight_layout()
+        fig.tight_layout()
         output_path = os.path.join(output_folder, 'feature_importance.png')
-        plt.savefig(output_path, dpi=150, facecolor='#0F172A')
-        plt.close()
+        _save_figure(fig, output_path)
         
         return output_path
         
@@ -89,7 +107,8 @@ def generate_feature_importance(features_df, output_folder):
 def generate_anomaly_distribution(anomalies_df, output_folder):
     """Generate anomaly distribution visualization"""
     try:
-        fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+        fig = Figure(figsize=(14, 10))
+        axes = fig.subplots(2, 2)
         fig.suptitle('Anomaly Detection Distribution', fontsize=16, fontweight='bold', color='#E2E8F0')
         
         # 1. Anomaly counts by model
@@ -130,10 +149,9 @@ def generate_anomaly_distribution(anomalies_df, output_folder):
                 colors=colors, startangle=90, textprops={'color': '#E2E8F0', 'fontsize': 12})
         ax4.set_title('Normal vs Anomaly Distribution', color='#E2E8F0')
         
-        plt.tight_layout()
+        fig.tight_layout()
         output_path = os.path.join(output_folder, 'anomaly_distribution.png')
-        plt.savefig(output_path, dpi=150, facecolor='#0F172A')
-        plt.close()
+        _save_figure(fig, output_path)
         
         return output_path
         
@@ -143,7 +161,8 @@ def generate_anomaly_distribution(anomalies_df, output_folder):
 def generate_model_comparison(anomalies_df, output_folder):
     """Generate model comparison visualization"""
     try:
-        fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+        fig = Figure(figsize=(14, 6))
+        axes = fig.subplots(1, 2)
         fig.suptitle('Model Performance Comparison', fontsize=16, fontweight='bold', color='#E2E8F0')
         
         # 1. Detection rates
@@ -187,10 +206,9 @@ def generate_model_comparison(anomalies_df, output_folder):
         ax2.grid(True, alpha=0.3, axis='y')
         ax2.set_ylim([0.8, 1.0])
         
-        plt.tight_layout()
+        fig.tight_layout()
         output_path = os.path.join(output_folder, 'model_comparison.png')
-        plt.savefig(output_path, dpi=150, facecolor='#0F172A')
-        plt.close()
+        _save_figure(fig, output_path)
         
         return output_path
         
@@ -203,8 +221,8 @@ def generate_report_summary(anomalies_df, features_df, output_folder):
         total_users = len(anomalies_df)
         anomalies_detected = anomalies_df['combined_anomaly'].sum()
         
-        # Get top anomalies
-        top_anomalies = anomalies_df.nlargest(10, 'anomaly_score')[['user', 'anomaly_score', 'reason']].to_dict('records')
+        # Get top anomalies with their contributing features
+        top_anomalies = format_top_anomalies(anomalies_df.nlargest(10, 'anomaly_score'))
         
         # Calculate statistics
         summary = {
@@ -261,21 +279,120 @@ def generate_report_summary(anomalies_df, features_df, output_folder):
     except Exception as e:
         raise Exception(f"Report summary generation failed: {str(e)}")
 
-def generate_all_reports(anomalies_path, features_path, output_folder):
-    """Generate all visualization reports"""
+def _histogram(values, bins=30):
+    """Precompute histogram bins for client-side rendering"""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {'bin_edges': [], 'counts': [], 'mean': None}
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        'bin_edges': np.round(edges, 6).tolist(),
+        'counts': counts.tolist(),
+        'mean': float(values.mean())
+    }
+
+def compute_chart_data(anomalies_df, features_df, bins=30):
+    """
+    Compute the data behind every report chart as compact JSON-serializable values.
+
+    Mirrors the PNG reports (confusion matrix, feature importance, anomaly
+    distribution, model comparison) without rasterizing anything.
+    """
+    try:
+        total = len(anomalies_df)
+        if_count = int(anomalies_df['isolation_forest_anomaly'].sum())
+        ae_count = int(anomalies_df['autoencoder_anomaly'].sum())
+        combined_count = int(anomalies_df['combined_anomaly'].sum())
+        normal = total - combined_count
+
+        # Same simulated confusion matrix as generate_confusion_matrix
+        tp = int(combined_count * 0.93)
+        tn = int(normal * 0.97)
+
+        feature_cols = [col for col in features_df.columns if col != 'user']
+        variances = features_df[feature_cols].to_numpy(dtype=float).var(axis=0, ddof=1)
+        variances = np.nan_to_num(variances)
+        importance = variances / variances.sum() if variances.sum() > 0 else np.zeros_like(variances)
+        order = np.argsort(importance)[::-1][:15]
+
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'confusion_matrix': {
+                'labels': ['Normal', 'Anomaly'],
+                'matrix': [[tn, normal - tn], [combined_count - tp, tp]]
+            },
+            'feature_importance': [
+                {'feature': feature_cols[i], 'importance': float(importance[i])} for i in order
+            ],
+            'model_counts': [
+                {'model': 'Isolation Forest', 'anomalies': if_count},
+                {'model': 'Autoencoder', 'anomalies': ae_count},
+                {'model': 'Combined', 'anomalies': combined_count}
+            ],
+            'detection_rates': [
+                {'model': 'Isolation Forest', 'rate': if_count / total * 100 if total else 0.0},
+                {'model': 'Autoencoder', 'rate': ae_count / total * 100 if total else 0.0},
+                {'model': 'Combined', 'rate': combined_count / total * 100 if total else 0.0}
+            ],
+            'anomaly_split': [
+                {'name': 'Normal', 'value': normal},
+                {'name': 'Anomaly', 'value': combined_count}
+            ],
+            'anomaly_score_histogram': _histogram(anomalies_df['anomaly_score'], bins),
+            'reconstruction_error_histogram': _histogram(anomalies_df['reconstruction_error'], bins)
+        }
+
+    except Exception as e:
+        raise Exception(f"Chart data computation failed: {str(e)}")
+
+def generate_chart_data(anomalies_df, features_df, output_folder):
+    """Write chart data JSON for client-side rendering"""
+    output_path = os.path.join(output_folder, 'chart_data.json')
+    with open(output_path, 'w') as f:
+        json.dump(compute_chart_data(anomalies_df, features_df), f)
+
+    return output_path
+
+# PNG chart generators, keyed by artifact name
+PNG_REPORTS = {
+    'confusion_matrix': lambda anomalies_df, features_df, folder: generate_confusion_matrix(anomalies_df, folder),
+    'feature_importance': lambda anomalies_df, features_df, folder: generate_feature_importance(features_df, folder),
+    'anomaly_distribution': lambda anomalies_df, features_df, folder: generate_anomaly_distribution(anomalies_df, folder),
+    'model_comparison': lambda anomalies_df, features_df, folder: generate_model_comparison(anomalies_df, folder)
+}
+
+def generate_png_report(report_name, anomalies_path, features_path, output_folder):
+    """Render a single PNG report on demand"""
+    try:
+        anomalies_df = pd.read_csv(anomalies_path)
+        features_df = pd.read_csv(features_path)
+
+        return PNG_REPORTS[report_name](anomalies_df, features_df, output_folder)
+
+    except Exception as e:
+        raise Exception(f"Report generation failed: {str(e)}")
+
+def generate_all_reports(anomalies_path, features_path, output_folder, mode='full'):
+    """
+    Generate all reports.
+
+    mode='data' only writes chart data JSON and the summary (no rasterizing);
+    mode='full' also renders every PNG chart.
+    """
     try:
         # Load data
         anomalies_df = pd.read_csv(anomalies_path)
         features_df = pd.read_csv(features_path)
         
-        # Generate all reports
         report_files = {
-            'confusion_matrix': generate_confusion_matrix(anomalies_df, output_folder),
-            'feature_importance': generate_feature_importance(features_df, output_folder),
-            'anomaly_distribution': generate_anomaly_distribution(anomalies_df, output_folder),
-            'model_comparison': generate_model_comparison(anomalies_df, output_folder),
+            'chart_data': generate_chart_data(anomalies_df, features_df, output_folder),
             'report_summary': generate_report_summary(anomalies_df, features_df, output_folder)
         }
+
+        if mode == 'full':
+            for report_name, generate in PNG_REPORTS.items():
+                report_files[report_name] = generate(anomalies_df, features_df, output_folder)
         
         return report_files
         
@@ -1,5 +1,7 @@
 import os
 import shutil
+import threading
+import uuid
 from pathlib import Path
 
 def allowed_file(filename, allowed_extensions):
@@ -31,6 +33,29 @@ def cleanup_temp_folders(folders):
                 except Exception as e:
                     print(f'Failed to delete {file_path}. Reason: {e}')
 
+def cleanup_temp_folders_async(folders):
+    """
+    Empty temporary folders without blocking the caller.
+    
+    Each folder is renamed aside and recreated empty right away; the old
+    contents are deleted by a background thread.
+    """
+    trash = []
+    for folder in folders:
+        if os.path.exists(folder):
+            trash_path = f"{folder.rstrip(os.sep)}.trash-{uuid.uuid4().hex}"
+            os.rename(folder, trash_path)
+            trash.append(trash_path)
+        os.makedirs(folder, exist_ok=True)
+    
+    if trash:
+        threading.Thread(target=remove_folders, args=(trash,), daemon=True).start()
+
+def remove_folders(folders):
+    """Delete folders and everything inside them"""
+    for folder in folders:
+        shutil.rmtree(folder, ignore_errors=True)
+
 def ensure_folder_exists(folder_path):
     """Ensure a folder exists, create if it doesn't"""
     Path(folder_path).mkdir(parents=True, exist_ok=True)
@@ -54,3 +79,25 @@ def get_all_files_in_folder(folder_path):
             })
     
     return files
+
+def format_top_anomalies(anomalies_df):
+    """Records of user, score, reason and top contributing features for an anomalies table"""
+    records = []
+    for _, row in anomalies_df.iterrows():
+        user = row['user'].item() if hasattr(row['user'], 'item') else row['user']
+        record = {'user': user, 'anomaly_score': float(row['anomaly_score']), 'reason': row['reason']}
+        
+        j = 1
+        top_features = []
+        while f'top_feature_{j}' in anomalies_df.columns:
+            top_features.append({
+                'feature': row[f'top_feature_{j}'],
+                'z_score': float(row[f'top_feature_{j}_z']),
+                'contribution': float(row[f'top_feature_{j}_share'])
+            })
+            j += 1
+        if top_features:
+            record['top_features'] = top_features
+        
+        records.append(record)
+    return records
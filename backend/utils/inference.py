@@ -0,0 +1,160 @@
+import numpy as np
+import queue
+import threading
+import time
+
+from utils.run_detection import score_batch
+
+class _ScoringRequest:
+    """A single caller's feature matrix waiting to be scored"""
+
+    def __init__(self, X):
+        self.X = X
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class InferenceService:
+    """
+    In-process micro-batching scorer shared by all request threads.
+
+    Callers enqueue feature matrices; a single worker thread coalesces requests
+    arriving within `batch_window_ms` (up to `max_batch_rows` rows), runs the
+    scaler, Isolation Forest and autoencoder once per batch and hands each
+    caller back its own row slice. Keeping every model call on one thread also
+    avoids contention on the Keras model.
+    """
+
+    def __init__(self, models, batch_window_ms=5.0, max_batch_rows=65536, model_version=None):
+        self._models = models
+        self.model_version = model_version
+        self._batch_window = batch_window_ms / 1000.0
+        self._max_batch_rows = max_batch_rows
+        self._queue = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'requests_total': 0,
+            'batches_total': 0,
+            'rows_total': 0,
+            'errors_total': 0,
+            'max_batch_requests': 0,
+            'max_batch_rows': 0,
+            'last_batch_requests': 0,
+            'last_batch_rows': 0,
+            'last_batch_latency_ms': 0.0,
+            'queue_wait_ms_total': 0.0
+        }
+        self._thread = threading.Thread(target=self._run, name='inference-service', daemon=True)
+        self._thread.start()
+
+    @property
+    def n_features(self):
+        return getattr(self._models['scaler'], 'n_features_in_', None)
+
+    def swap_models(self, models, model_version=None):
+        """Replace the model set; takes effect from the next batch"""
+        self._models = models
+        self.model_version = model_version
+
+    def score(self, X, timeout=None):
+        """Score a feature matrix and block until its slice of a batch is ready"""
+        X = np.asarray(X, dtype=float)
+        if X.ndim != 2:
+            raise ValueError("Feature matrix must be 2-dimensional")
+        if self.n_features is not None and X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+
+        request = _ScoringRequest(X)
+        self._queue.put(request)
+
+        if not request.done.wait(timeout):
+            raise TimeoutError("Inference request timed out")
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def stop(self):
+        """Stop the worker thread after the queued requests are served"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def get_metrics(self):
+        """Return queue depth and batch-size metrics"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        batches = metrics['batches_total']
+        requests = metrics['requests_total']
+        queue_wait_ms_total = metrics.pop('queue_wait_ms_total')
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['avg_batch_requests'] = requests / batches if batches else 0.0
+        metrics['avg_batch_rows'] = metrics['rows_total'] / batches if batches else 0.0
+        metrics['avg_queue_wait_ms'] = queue_wait_ms_total / requests if requests else 0.0
+        metrics['batch_window_ms'] = self._batch_window * 1000.0
+        return metrics
+
+    def _run(self):
+        """Worker loop: collect a micro-batch, score it, repeat"""
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = [first]
+            rows = len(first.X)
+            deadline = time.monotonic() + self._batch_window
+            stopping = False
+
+            while rows < self._max_batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                rows += len(item.X)
+
+            self._process(batch, rows)
+            if stopping:
+                return
+
+    def _process(self, batch, rows):
+        """Score a batch once and distribute per-caller slices"""
+        started = time.monotonic()
+        failed = False
+
+        try:
+            outputs = score_batch(np.vstack([r.X for r in batch]), self._models)
+            offset = 0
+            for request in batch:
+                end = offset + len(request.X)
+                request.result = {key: value[offset:end] for key, value in outputs.items()}
+                offset = end
+        except Exception as e:
+            failed = True
+            for request in batch:
+                request.error = e
+
+        finished = time.monotonic()
+        with self._metrics_lock:
+            m = self._metrics
+            m['requests_total'] += len(batch)
+            m['batches_total'] += 1
+            m['rows_total'] += rows
+            m['errors_total'] += len(batch) if failed else 0
+            m['max_batch_requests'] = max(m['max_batch_requests'], len(batch))
+            m['max_batch_rows'] = max(m['max_batch_rows'], rows)
+            m['last_batch_requests'] = len(batch)
+            m['last_batch_rows'] = rows
+            m['last_batch_latency_ms'] = (finished - started) * 1000.0
+            m['queue_wait_ms_total'] += sum((started - r.enqueued_at) * 1000.0 for r in batch)
+
+        for request in batch:
+            request.done.set()
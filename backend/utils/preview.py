@@ -0,0 +1,129 @@
+import io
+import os
+import random
+from contextlib import ExitStack
+import pandas as pd
+import numpy as np
+
+from utils.feature_extraction import (compute_partial_aggregates, merge_partial_aggregates,
+                                      finalize_features, PARTIAL_SUM_COLUMNS)
+
+SAMPLE_BLOCK_BYTES = 256 * 1024
+PREVIEW_CHUNK_ROWS = 200000
+
+def _read_header(file_path):
+    with open(file_path, 'rb') as f:
+        return f.readline()
+
+def sample_log_rows(input_paths, sample_bytes, block_bytes=SAMPLE_BLOCK_BYTES, seed=None):
+    """
+    Read a uniform sample of raw log rows without scanning the files.
+
+    Blocks of `block_bytes` are read at random offsets (about `sample_bytes`
+    in total, spread over the files by size) and cut to whole lines. Returns
+    the sampled rows of each file, the fraction of each file they represent
+    and the fraction of all input bytes sampled.
+    """
+    rng = random.Random(seed)
+    sizes = [os.path.getsize(p) for p in input_paths]
+    total_bytes = sum(sizes) or 1
+    frames, fractions, sampled_total = [], [], 0
+
+    for file_path, size in zip(input_paths, sizes):
+        share = int(sample_bytes * size / total_bytes)
+        header = _read_header(file_path)
+
+        # Small files are read whole
+        if size <= max(share, block_bytes * 2):
+            frames.append(pd.read_csv(file_path, on_bad_lines='skip'))
+            fractions.append(1.0)
+            sampled_total += size
+            continue
+
+        n_blocks = max(1, share // block_bytes)
+        offsets = sorted(rng.sample(range(len(header), size - block_bytes), n_blocks))
+        chunks, sampled_bytes = [], 0
+        with open(file_path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                block = f.read(block_bytes)
+                # Drop the partial first and last lines of the block
+                lines = block.split(b'\n')[1:-1]
+                if lines:
+                    chunks.append(b'\n'.join(lines))
+                    sampled_bytes += sum(len(line) + 1 for line in lines)
+
+        data = header + b'\n'.join(chunks) + b'\n' if chunks else header
+        frames.append(pd.read_csv(io.BytesIO(data), on_bad_lines='skip', encoding_errors='replace'))
+        fractions.append(min(1.0, sampled_bytes / max(size - len(header), 1)))
+        sampled_total += sampled_bytes
+
+    return frames, fractions, min(1.0, sampled_total / total_bytes)
+
+def _extrapolate_partial(partial, fraction):
+    """Scale a file's partial aggregate up to the whole file"""
+    if fraction >= 1.0:
+        return partial
+    scale = 1.0 / max(fraction, 1e-9)
+    sums = partial['sums'].copy()
+    sums[PARTIAL_SUM_COLUMNS] = np.round(sums[PARTIAL_SUM_COLUMNS] * scale)
+    return {**partial, 'sums': sums, 'rows': int(round(partial['rows'] * scale))}
+
+def estimate_features(file_partials, file_fractions):
+    """
+    Feature table from per-file partial aggregates, each covering `fraction` of its file.
+
+    Counters are extrapolated per file before merging, so users of a fully read
+    shard keep exact counts while those of a partly read one are scaled up.
+    Files without any rows read yet are left out.
+    """
+    scaled = [
+        _extrapolate_partial(partial, fraction)
+        for partial, fraction in zip(file_partials, file_fractions)
+        if partial is not None and partial['rows'] > 0
+    ]
+    return finalize_features(merge_partial_aggregates(scaled))
+
+def iter_progressive_partials(input_paths, checkpoints=(0.1, 0.25, 0.5), chunk_rows=PREVIEW_CHUNK_ROWS):
+    """
+    Read all logs in row chunks, yielding the per-file aggregates as they refine.
+
+    Chunks are interleaved across files, always advancing the file that is
+    least far along, so every shard is represented at each checkpoint.
+    Yields (fraction_of_bytes_read, file_partials, file_fractions) at each
+    checkpoint and once more, exactly, after the last chunk.
+    """
+    sizes = [os.path.getsize(p) for p in input_paths]
+    total_bytes = sum(sizes) or 1
+    pending = sorted(checkpoints)
+
+    with ExitStack() as stack:
+        handles = [stack.enter_context(open(p, 'rb')) for p in input_paths]
+        readers = [pd.read_csv(f, chunksize=chunk_rows) for f in handles]
+        file_partials = [None] * len(input_paths)
+        file_fractions = [0.0] * len(input_paths)
+        active = set(range(len(input_paths)))
+
+        while active:
+            i = min(active, key=lambda j: file_fractions[j])
+            try:
+                chunk = next(readers[i])
+            except StopIteration:
+                active.discard(i)
+                file_fractions[i] = 1.0
+                continue
+
+            chunk_partial = compute_partial_aggregates(chunk)
+            file_partials[i] = chunk_partial if file_partials[i] is None else merge_partial_aggregates([file_partials[i], chunk_partial])
+            file_fractions[i] = min(handles[i].tell(), sizes[i]) / (sizes[i] or 1)
+
+            # Checkpoints wait until every file has contributed rows
+            fraction = sum(f * size for f, size in zip(file_fractions, sizes)) / total_bytes
+            started = all(p is not None or j not in active for j, p in enumerate(file_partials))
+            if started and pending and fraction >= pending[0] and fraction < 1.0:
+                while pending and fraction >= pending[0]:
+                    pending.pop(0)
+                yield fraction, list(file_partials), list(file_fractions)
+
+    empty = compute_partial_aggregates(pd.DataFrame(columns=['user']))
+    yield 1.0, [p if p is not None else empty for p in file_partials], [1.0] * len(input_paths)
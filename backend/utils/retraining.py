@@ -0,0 +1,446 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from utils.run_detection import load_models
+from utils.state import SharedState
+
+MODEL_FILES = ('isolation_forest.pkl', 'autoencoder.keras', 'scaler.pkl')
+
+RETRAIN_STATUS_DEFAULTS = {
+    'state': 'idle',
+    'pid': None,
+    'started_at': None,
+    'finished_at': None,
+    'version': None,
+    'activated': False,
+    'metrics': None,
+    'error': None
+}
+
+# Seconds a claimed job may run without a recorded pid (still launching) before it is considered lost
+RETRAIN_LAUNCH_GRACE_SECONDS = 60
+
+def get_versions_folder(models_folder):
+    return os.path.join(models_folder, 'versions')
+
+def resolve_model_folder(models_folder):
+    """
+    Folder holding the active model set.
+
+    Once a retrained set has been activated, `models/current` is a symlink to
+    its version folder; before that the artifacts sit directly in `models/`.
+    """
+    current = os.path.join(models_folder, 'current')
+    if os.path.islink(current):
+        return os.path.realpath(current)
+    return models_folder
+
+def get_retrain_status(models_folder):
+    """Shared retraining job status, readable from every serving worker"""
+    os.makedirs(get_versions_folder(models_folder), exist_ok=True)
+    return SharedState(os.path.join(get_versions_folder(models_folder), 'retrain_status.json'), RETRAIN_STATUS_DEFAULTS)
+
+def _read_history(models_folder):
+    history_path = os.path.join(get_versions_folder(models_folder), 'history.json')
+    try:
+        with open(history_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def _write_history(models_folder, history):
+    history_path = os.path.join(get_versions_folder(models_folder), 'history.json')
+    tmp_path = history_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, history_path)
+
+def list_model_versions(models_folder):
+    """Describe every stored model version and which one is active"""
+    versions_folder = get_versions_folder(models_folder)
+    active = os.path.basename(resolve_model_folder(models_folder)) if os.path.islink(os.path.join(models_folder, 'current')) else None
+
+    versions = []
+    for folder in sorted(glob.glob(os.path.join(versions_folder, '*', 'metadata.json'))):
+        with open(folder) as f:
+            metadata = json.load(f)
+        metadata['active'] = metadata['version'] == active
+        versions.append(metadata)
+
+    return {'active': active, 'history': _read_history(models_folder), 'versions': versions}
+
+def _archive_baseline(models_folder):
+    """Keep the original hand-trained models as the `baseline` version so they can be rolled back to"""
+    baseline = os.path.join(get_versions_folder(models_folder), 'baseline')
+    if os.path.exists(baseline) or not all(os.path.exists(os.path.join(models_folder, f)) for f in MODEL_FILES):
+        return
+    tmp = baseline + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in MODEL_FILES:
+        shutil.copy2(os.path.join(models_folder, name), os.path.join(tmp, name))
+    with open(os.path.join(tmp, 'metadata.json'), 'w') as f:
+        json.dump({'version': 'baseline', 'trained_at': None, 'metrics': None}, f, indent=2)
+    os.rename(tmp, baseline)
+
+def activate_model_version(models_folder, version, record=True):
+    """
+    Atomically switch the active model set to a stored version.
+
+    The `current` symlink is replaced with os.replace, so readers resolve
+    either the old or the new set, never a mix of both.
+    """
+    version_folder = os.path.join(get_versions_folder(models_folder), version)
+    if not all(os.path.exists(os.path.join(version_folder, f)) for f in MODEL_FILES):
+        raise ValueError(f"Model version not found: {version}")
+
+    _archive_baseline(models_folder)
+
+    current = os.path.join(models_folder, 'current')
+    history = _read_history(models_folder)
+    if not history and not os.path.islink(current) and os.path.exists(os.path.join(get_versions_folder(models_folder), 'baseline')):
+        history = ['baseline']
+
+    tmp_link = os.path.join(models_folder, f'.current-{os.getpid()}')
+    if os.path.lexists(tmp_link):
+        os.unlink(tmp_link)
+    os.symlink(os.path.join('versions', version), tmp_link)
+    os.replace(tmp_link, current)
+
+    if record:
+        history.append(version)
+        _write_history(models_folder, history)
+
+def rollback_model_version(models_folder, version=None):
+    """Re-activate `version`, or the version that was active before the current one"""
+    history = _read_history(models_folder)
+
+    if version is None:
+        if len(history) < 2:
+            raise ValueError("No previous model version to roll back to")
+        history.pop()
+        version = history[-1]
+        activate_model_version(models_folder, version, record=False)
+        _write_history(models_folder, history)
+    else:
+        activate_model_version(models_folder, version)
+
+    return version
+
+def collect_training_features(feature_paths):
+    """Concatenate stored user feature tables into one de-duplicated training table"""
+    tables = [pd.read_csv(p) for p in feature_paths if os.path.exists(p)]
+    if not tables:
+        raise ValueError("No stored feature tables to train on")
+    return pd.concat(tables, ignore_index=True).drop_duplicates()
+
+def _evaluate(models, X, reference_scaler, threshold_percentile):
+    """
+    Holdout metrics and per-row combined flags of a model set.
+
+    Each set standardizes with its own scaler, so reconstructions are mapped
+    back to raw feature space and their error is measured in one shared
+    `reference_scaler` space, making MSEs comparable across model sets.
+    Flags follow run_detection: Isolation Forest or autoencoder error above
+    the `threshold_percentile` of the set's own errors.
+    """
+    X_scaled = models['scaler'].transform(X)
+    reconstruction_scaled = models['autoencoder'].predict(X_scaled, verbose=0)
+    reconstruction = models['scaler'].inverse_transform(reconstruction_scaled)
+
+    errors = np.mean(np.square(reference_scaler.transform(X) - reference_scaler.transform(reconstruction)), axis=1)
+
+    own_errors = np.mean(np.square(X_scaled - reconstruction_scaled), axis=1)
+    if_flags = models['isolation_forest'].predict(X_scaled) == -1
+    flags = if_flags | (own_errors > np.percentile(own_errors, threshold_percentile))
+
+    metrics = {
+        'reconstruction_mse': float(errors.mean()),
+        'reconstruction_p95': float(np.percentile(errors, threshold_percentile)),
+        'isolation_forest_anomaly_rate': float(if_flags.mean()),
+        'combined_anomaly_rate': float(flags.mean())
+    }
+    return metrics, flags
+
+def _build_autoencoder(current_autoencoder, n_features):
+    """Reuse the current autoencoder architecture, or build a small dense one"""
+    from tensorflow import keras
+
+    if current_autoencoder is not None and current_autoencoder.input_shape[-1] == n_features:
+        model = keras.models.clone_model(current_autoencoder)
+    else:
+        bottleneck = max(2, n_features // 3)
+        model = keras.Sequential([
+            keras.layers.Input(shape=(n_features,)),
+            keras.layers.Dense(max(bottleneck * 2, 4), activation='relu'),
+            keras.layers.Dense(bottleneck, activation='relu'),
+            keras.layers.Dense(max(bottleneck * 2, 4), activation='relu'),
+            keras.layers.Dense(n_features, activation='linear')
+        ])
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+def train_model_set(features_df, current_models=None, max_training_rows=50000, holdout_fraction=0.2,
+                    epochs=30, random_state=42, threshold_percentile=95):
+    """
+    Fit a new scaler, Isolation Forest and autoencoder on a feature table.
+
+    Training rows are subsampled to `max_training_rows` to bound training time;
+    the forest is fitted on all cores. Returns the model set and holdout metrics
+    for both the candidate and (when given) the current models.
+    """
+    feature_cols = [col for col in features_df.columns if col != 'user']
+    X = features_df[feature_cols].to_numpy(dtype=float)
+
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(X))
+    n_holdout = max(1, int(len(X) * holdout_fraction))
+    X_holdout, X_train = X[order[:n_holdout]], X[order[n_holdout:]]
+    if len(X_train) > max_training_rows:
+        X_train = X_train[rng.choice(len(X_train), max_training_rows, replace=False)]
+    if len(X_train) < 10:
+        raise ValueError(f"Not enough training rows ({len(X_train)})")
+
+    scaler = StandardScaler().fit(X_train)
+    X_train_scaled = scaler.transform(X_train)
+
+    # Keep the current forest's hyperparameters, but use every core
+    forest_params = {'n_estimators': 200, 'contamination': 'auto', 'random_state': random_state}
+    if current_models is not None:
+        forest_params = current_models['isolation_forest'].get_params()
+    forest_params['n_jobs'] = -1
+    isolation_forest = IsolationForest(**forest_params).fit(X_train_scaled)
+
+    from tensorflow import keras
+
+    autoencoder = _build_autoencoder(current_models['autoencoder'] if current_models else None, len(feature_cols))
+    autoencoder.fit(
+        X_train_scaled, X_train_scaled,
+        epochs=epochs,
+        batch_size=256,
+        validation_split=0.1,
+        callbacks=[keras.callbacks.EarlyStopping(patience=3, restore_best_weights=True)],
+        verbose=0
+    )
+
+    candidate = {'isolation_forest': isolation_forest, 'autoencoder': autoencoder, 'scaler': scaler}
+
+    # Both sets are scored in the holdout's own standardization
+    reference_scaler = StandardScaler().fit(X_holdout)
+    candidate_metrics, candidate_flags = _evaluate(candidate, X_holdout, reference_scaler, threshold_percentile)
+    metrics = {
+        'training_rows': int(len(X_train)),
+        'holdout_rows': int(len(X_holdout)),
+        'feature_names': feature_cols,
+        'candidate': candidate_metrics,
+        'current': None,
+        'flag_agreement': None
+    }
+    if current_models is not None:
+        try:
+            metrics['current'], current_flags = _evaluate(current_models, X_holdout, reference_scaler, threshold_percentile)
+            metrics['flag_agreement'] = float((candidate_flags == current_flags).mean())
+        except Exception as e:
+            # Current models that can't score today's features are always replaced
+            metrics['current_error'] = str(e)
+
+    return candidate, metrics
+
+def validate_candidate(metrics, tolerance=0.05, max_anomaly_rate=0.25, max_flag_rate_increase=0.05):
+    """
+    Accept a candidate that reconstructs the holdout no worse than the current set
+    and does not flag markedly more of it.
+    """
+    candidate = metrics['candidate']
+    if candidate['isolation_forest_anomaly_rate'] > max_anomaly_rate:
+        return False, f"Isolation Forest flags {candidate['isolation_forest_anomaly_rate']:.1%} of the holdout"
+    if candidate['combined_anomaly_rate'] > max_anomaly_rate:
+        return False, f"Combined detection flags {candidate['combined_anomaly_rate']:.1%} of the holdout"
+
+    current = metrics.get('current')
+    if current is None:
+        return True, None
+
+    if candidate['reconstruction_mse'] > current['reconstruction_mse'] * (1 + tolerance):
+        return False, (f"Holdout reconstruction MSE {candidate['reconstruction_mse']:.4f} is worse than "
+                       f"the current {current['reconstruction_mse']:.4f}")
+
+    # Flagging fewer rows than drifted current models is expected; flagging many more is not
+    if candidate['combined_anomaly_rate'] > current['combined_anomaly_rate'] + max_flag_rate_increase:
+        return False, (f"Candidate flags {candidate['combined_anomaly_rate']:.1%} of the holdout, "
+                       f"the current models {current['combined_anomaly_rate']:.1%}")
+
+    return True, None
+
+def save_model_version(models_folder, models, metrics):
+    """Write a model set to a new version folder and return its version id"""
+    version = datetime.now().strftime('%Y%m%d-%H%M%S')
+    versions_folder = get_versions_folder(models_folder)
+    tmp = os.path.join(versions_folder, f'.tmp-{version}')
+    os.makedirs(tmp, exist_ok=True)
+
+    with open(os.path.join(tmp, 'isolation_forest.pkl'), 'wb') as f:
+        pickle.dump(models['isolation_forest'], f)
+    with open(os.path.join(tmp, 'scaler.pkl'), 'wb') as f:
+        pickle.dump(models['scaler'], f)
+    models['autoencoder'].save(os.path.join(tmp, 'autoencoder.keras'))
+
+    with open(os.path.join(tmp, 'metadata.json'), 'w') as f:
+        json.dump({'version': version, 'trained_at': datetime.now().isoformat(), 'metrics': metrics}, f, indent=2)
+
+    os.rename(tmp, os.path.join(versions_folder, version))
+    return version
+
+def _is_zombie(pid):
+    """Check whether a process has exited but not been reaped yet (Linux /proc)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except (OSError, IndexError):
+        return False
+
+def is_retraining_running(status):
+    """Check whether a retraining job is still alive"""
+    if status['state'] != 'running':
+        return False
+    if not status['pid']:
+        # Claimed by a request that is still launching the process
+        return time.time() - (status['started_at'] or 0) < RETRAIN_LAUNCH_GRACE_SECONDS
+    try:
+        os.kill(status['pid'], 0)
+    except OSError:
+        return False
+    return not _is_zombie(status['pid'])
+
+def _reap_retraining_process(models_folder, process):
+    """Wait for the job process and mark the job failed if it died without reporting"""
+    exit_code = process.wait()
+    get_retrain_status(models_folder).update(
+        {'state': 'failed', 'error': f"Retraining process exited with code {exit_code}", 'finished_at': time.time()},
+        expect={'state': 'running', 'pid': process.pid}
+    )
+
+def start_retraining_process(models_folder, feature_paths, options):
+    """
+    Launch run_retraining_job in a separate process and return it.
+
+    The job is claimed in the shared status under its file lock first, so of
+    concurrent requests (from any worker) only one starts a process; the others
+    get None. The job runs as `python -m utils.retraining`, so it imports only
+    what training needs instead of re-importing the serving app. A watcher
+    thread reaps the process and records a failure if it is killed (e.g. OOM)
+    before writing its own status.
+    """
+    status = get_retrain_status(models_folder)
+    started_at = time.time()
+    claimed = status.apply(lambda state: None if is_retraining_running(state) else {
+        **RETRAIN_STATUS_DEFAULTS, 'state': 'running', 'started_at': started_at
+    })
+    if not claimed:
+        return None
+
+    command = [
+        sys.executable, '-m', 'utils.retraining',
+        '--models-dir', models_folder,
+        '--max-training-rows', str(options['max_training_rows']),
+        '--epochs', str(options['epochs'])
+    ]
+    if not options['activate']:
+        command.append('--no-activate')
+
+    try:
+        process = subprocess.Popen(command + ['--'] + list(feature_paths))
+    except OSError as e:
+        status.update({'state': 'failed', 'error': str(e), 'finished_at': time.time()}, expect={'started_at': started_at})
+        raise
+    status.update({'pid': process.pid}, expect={'started_at': started_at})
+    threading.Thread(target=_reap_retraining_process, args=(models_folder, process),
+                     name='retraining-reaper', daemon=True).start()
+    return process
+
+def run_retraining_job(models_folder, feature_paths, options):
+    """
+    Retraining job entry point, run in a separate low-priority process.
+
+    Trains a candidate, validates it against the active set on a holdout and,
+    if accepted (and `options['activate']`), atomically activates it.
+    """
+    status = get_retrain_status(models_folder)
+    try:
+        os.nice(options.get('niceness', 10))
+
+        active_folder = resolve_model_folder(models_folder)
+        current_paths = [os.path.join(active_folder, f) for f in MODEL_FILES]
+        current_models, current_error = None, None
+        if all(os.path.exists(p) for p in current_paths):
+            try:
+                current_models = load_models(*current_paths)
+            except Exception as e:
+                # Broken active models are exactly what retraining has to replace
+                current_error = f"Active models could not be loaded: {e}"
+
+        features_df = collect_training_features(feature_paths)
+        candidate, metrics = train_model_set(
+            features_df,
+            current_models,
+            max_training_rows=options.get('max_training_rows', 50000),
+            epochs=options.get('epochs', 30)
+        )
+        if current_error:
+            metrics['current_error'] = current_error
+
+        accepted, reason = validate_candidate(metrics)
+        metrics['accepted'] = accepted
+        metrics['rejection_reason'] = reason
+        version = save_model_version(models_folder, candidate, metrics)
+
+        activated = accepted and options.get('activate', True)
+        if activated:
+            activate_model_version(models_folder, version)
+
+        status['metrics'] = metrics
+        status['version'] = version
+        status['activated'] = activated
+        status['state'] = 'completed' if accepted else 'rejected'
+
+    except Exception as e:
+        status['error'] = f"{str(e)}\n{traceback.format_exc()}"
+        status['state'] = 'failed'
+
+    finally:
+        status['finished_at'] = time.time()
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrain the detection models on stored feature tables')
+    parser.add_argument('feature_paths', nargs='+', help='User feature tables to train on')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--max-training-rows', type=int, default=50000)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--no-activate', dest='activate', action='store_false',
+                        help='Store and validate the new version without activating it')
+    args = parser.parse_args()
+
+    run_retraining_job(args.models_dir, args.feature_paths, {
+        'activate': args.activate,
+        'max_training_rows': args.max_training_rows,
+        'epochs': args.epochs
+    })
+    return 0 if get_retrain_status(args.models_dir)['state'] in ('completed', 'rejected') else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,94 @@
 import pandas as pd
 import numpy as np
 import pickle
-from tensorflow import keras
 from sklearn.preprocessing import StandardScaler
 import warnings
 warnings.filterwarnings('ignore')
 
-def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler_path, output_path):
+from utils.helper import format_top_anomalies
+
+# Bump whenever detection logic changes so cached results are invalidated
+DETECTION_VERSION = '2'
+
+# Reconstruction error percentile above which the autoencoder flags a user
+AE_THRESHOLD_PERCENTILE = 95
+
+# Number of top contributing features reported per user
+TOP_K_FEATURES = 3
+
+def load_sklearn_models(isolation_forest_path, scaler_path):
+    """Load only the Isolation Forest and scaler (no TensorFlow runtime state)"""
+    with open(isolation_forest_path, 'rb') as f:
+        isolation_forest = pickle.load(f)
+    
+    with open(scaler_path, 'rb') as f:
+        scaler = pickle.load(f)
+    
+    return {
+        'isolation_forest': isolation_forest,
+        'scaler': scaler
+    }
+
+def load_autoencoder(autoencoder_path):
+    """Load the Keras autoencoder"""
+    # TensorFlow is imported on first use: extraction workers and the serving
+    # master import this module but never need it
+    from tensorflow import keras
+    return keras.models.load_model(autoencoder_path)
+
+def load_models(isolation_forest_path, autoencoder_path, scaler_path):
+    """Load the Isolation Forest, autoencoder and scaler into a model set"""
+    models = load_sklearn_models(isolation_forest_path, scaler_path)
+    models['autoencoder'] = load_autoencoder(autoencoder_path)
+    return models
+
+def score_batch(X, models):
+    """
+    Run the three-model pipeline once over a feature matrix.
+
+    Returns row-aligned raw model outputs; thresholds and score normalization
+    are applied per detection run by the caller.
+    """
+    X_scaled = models['scaler'].transform(X)
+    
+    return {
+        'X_scaled': X_scaled,
+        'if_predictions': models['isolation_forest'].predict(X_scaled),
+        'if_scores': models['isolation_forest'].score_samples(X_scaled),
+        'X_reconstructed': models['autoencoder'].predict(X_scaled, verbose=0)
+    }
+
+def compute_feature_attributions(X_scaled, squared_residuals, k=TOP_K_FEATURES):
+    """
+    Rank each user's features by their share of the reconstruction error.
+
+    Uses the autoencoder's per-feature squared residuals, which detection
+    already computes, so attribution costs no extra model calls. Returns
+    (n_users, k) arrays of feature indices, error shares and z-scores
+    (the scaled feature values), ordered by decreasing contribution.
+    """
+    k = min(k, squared_residuals.shape[1])
+    rows = np.arange(len(squared_residuals))[:, None]
+    
+    top = np.argpartition(-squared_residuals, k - 1, axis=1)[:, :k]
+    top = top[rows, np.argsort(-squared_residuals[rows, top], axis=1)]
+    
+    totals = squared_residuals.sum(axis=1, keepdims=True)
+    shares = np.divide(squared_residuals[rows, top], totals, out=np.zeros(top.shape), where=totals > 0)
+    z_scores = X_scaled[rows, top]
+    
+    return top, shares, z_scores
+
+def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler_path, output_path,
+                  inference_service=None, models=None):
     """
     Run anomaly detection using both Isolation Forest and Autoencoder models.
     Combine results and generate anomaly reasons.
     
+    When an `inference_service` is given, scoring is delegated to it so that
+    concurrent detections share micro-batched model calls; an already loaded
+    `models` set (see load_models) is used as-is instead of loading from disk.
+    
     Returns detection results and statistics.
     """
     try:
@@ -22,33 +100,32 @@ def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler
         feature_cols = [col for col in df.columns if col != 'user']
         X = df[feature_cols].values
         
-        # Load models
-        with open(isolation_forest_path, 'rb') as f:
-            isolation_forest = pickle.load(f)
-        
-        autoencoder = keras.models.load_model(autoencoder_path)
+        # Score with the shared service, preloaded models or freshly loaded models
+        if inference_service is not None:
+            outputs = inference_service.score(X)
+        elif models is not None:
+            outputs = score_batch(X, models)
+        else:
+            outputs = score_batch(X, load_models(isolation_forest_path, autoencoder_path, scaler_path))
         
-        with open(scaler_path, 'rb') as f:
-            scaler = pickle.load(f)
-        
-        # Scale features
-        X_scaled = scaler.transform(X)
+        X_scaled = outputs['X_scaled']
         
         # --- Isolation Forest Detection ---
-        if_predictions = isolation_forest.predict(X_scaled)
-        if_scores = isolation_forest.score_samples(X_scaled)
+        if_predictions = outputs['if_predictions']
+        if_scores = outputs['if_scores']
         # Convert: -1 (anomaly) -> 1, 1 (normal) -> 0
         if_anomalies = (if_predictions == -1).astype(int)
         
         # --- Autoencoder Detection ---
-        # Reconstruct data
-        X_reconstructed = autoencoder.predict(X_scaled, verbose=0)
+        # Reconstructed data
+        X_reconstructed = outputs['X_reconstructed']
         
-        # Calculate reconstruction error (MSE)
-        reconstruction_errors = np.mean(np.square(X_scaled - X_reconstructed), axis=1)
+        # Calculate reconstruction error (MSE), keeping the per-feature residuals for attribution
+        squared_residuals = np.square(X_scaled - X_reconstructed)
+        reconstruction_errors = np.mean(squared_residuals, axis=1)
         
         # Determine threshold (e.g., 95th percentile)
-        threshold = np.percentile(reconstruction_errors, 95)
+        threshold = np.percentile(reconstruction_errors, AE_THRESHOLD_PERCENTILE)
         ae_anomalies = (reconstruction_errors > threshold).astype(int)
         
         # --- Combined Detection ---
@@ -60,9 +137,13 @@ def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler
         ae_scores_norm = (reconstruction_errors - reconstruction_errors.min()) / (reconstruction_errors.max() - reconstruction_errors.min())
         combined_scores = (if_scores_norm + ae_scores_norm) / 2
         
+        # Top contributing features per user from the reconstruction residuals
+        top_idx, top_shares, top_z = compute_feature_attributions(X_scaled, squared_residuals)
+        top_names = np.asarray(feature_cols)[top_idx]
+        
         # Generate anomaly reasons
-        reasons = []
-        for i in range(len(users)):
+        reasons = np.full(len(users), "Normal behavior", dtype=object)
+        for i in np.flatnonzero(combined_anomalies):
             reason_parts = []
             
             if if_anomalies[i] == 1:
@@ -72,21 +153,11 @@ def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler
                 reason_parts.append("High reconstruction error")
             
             # Add specific feature-based reasons
-            user_features = df.iloc[i]
-            
-            if 'failure_rate' in df.columns and user_features['failure_rate'] > 0.3:
-                reason_parts.append(f"High failure rate ({user_features['failure_rate']:.2%})")
-            
-            if 'after_hours_count' in df.columns and user_features['after_hours_count'] > 10:
-                reason_parts.append(f"Excessive after-hours activity ({int(user_features['after_hours_count'])})")
+            for name, z, share in zip(top_names[i], top_z[i], top_shares[i]):
+                direction = "High" if z >= 0 else "Low"
+                reason_parts.append(f"{direction} {name} (z={z:+.2f}, {share:.0%} of error)")
             
-            if 'file_download_count' in df.columns and user_features['file_download_count'] > 50:
-                reason_parts.append(f"Unusual download volume ({int(user_features['file_download_count'])})")
-            
-            if combined_anomalies[i] == 1 and not reason_parts:
-                reason_parts.append("Anomalous behavior pattern detected")
-            
-            reasons.append("; ".join(reason_parts) if reason_parts else "Normal behavior")
+            reasons[i] = "; ".join(reason_parts)
         
         # Create results DataFrame
         results_df = pd.DataFrame({
@@ -100,6 +171,11 @@ def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler
             'reason': reasons
         })
         
+        for j in range(top_idx.shape[1]):
+            results_df[f'top_feature_{j + 1}'] = top_names[:, j]
+            results_df[f'top_feature_{j + 1}_z'] = top_z[:, j]
+            results_df[f'top_feature_{j + 1}_share'] = top_shares[:, j]
+        
         # Save results
         results_df.to_csv(output_path, index=False)
         
@@ -136,7 +212,7 @@ def run_detection(features_path, isolation_forest_path, autoencoder_path, scaler
                 'recall': 0.94,
                 'f1_score': 0.93
             },
-            'top_anomalies': results_df.nlargest(10, 'anomaly_score')[['user', 'anomaly_score', 'reason']].to_dict('records')
+            'top_anomalies': format_top_anomalies(results_df.nlargest(10, 'anomaly_score'))
         }
         
         return stats
@@ -0,0 +1,113 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+class SharedState:
+    """
+    Dict-like application state persisted to a JSON file.
+
+    Serving workers are separate processes, so state set by one request (e.g. an
+    upload) must be visible to the worker that handles the next one. Writes
+    replace the file atomically, and read-modify-write updates hold an exclusive
+    flock on a sidecar lock file so concurrent workers never lose each other's
+    changes. Reads are cached until the file is replaced.
+    """
+
+    def __init__(self, path, defaults):
+        self._path = path
+        self._lock_path = path + '.lock'
+        self._defaults = dict(defaults)
+        self._lock = threading.Lock()
+        self._cache = None
+        self._cache_id = None
+        self._cache_file = None
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the state lock across threads of this process and across processes"""
+        with self._lock:
+            with open(self._lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reset(self):
+        """Overwrite the persisted state with the defaults"""
+        with self._exclusive():
+            self._write(dict(self._defaults))
+
+    def _read(self):
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return dict(self._defaults)
+
+        # Writes always replace the file, and the cached version is kept open so
+        # its inode can't be reused: a different inode reliably marks a rewrite,
+        # even one landing within the same mtime tick
+        file_id = (st.st_dev, st.st_ino)
+        if self._cache is None or file_id != self._cache_id:
+            try:
+                f = open(self._path)
+                fst = os.fstat(f.fileno())
+                state = {**self._defaults, **json.load(f)}
+            except (OSError, ValueError):
+                return dict(self._cache or self._defaults)
+            if self._cache_file is not None:
+                self._cache_file.close()
+            self._cache, self._cache_id, self._cache_file = state, (fst.st_dev, fst.st_ino), f
+
+        return self._cache
+
+    def _write(self, state):
+        folder = os.path.dirname(self._path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.state-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path)
+        self._cache = None
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._read()[key]
+
+    def __setitem__(self, key, value):
+        with self._exclusive():
+            state = dict(self._read())
+            state[key] = value
+            self._write(state)
+
+    def update(self, values, expect=None):
+        """
+        Set several keys in one atomic write.
+
+        With `expect`, the write only happens if those keys still hold the
+        given values (e.g. the job id that owns the state); returns whether
+        the state was written.
+        """
+        with self._exclusive():
+            state = dict(self._read())
+            if expect and any(state.get(key) != value for key, value in expect.items()):
+                return False
+            state.update(values)
+            self._write(state)
+            return True
+
+    def apply(self, change):
+        """Atomically update the state with the values `change(state)` returns, and return them"""
+        with self._exclusive():
+            state = dict(self._read())
+            values = change(state)
+            if values:
+                state.update(values)
+                self._write(state)
+            return values
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._read().get(key, default)
@@ -0,0 +1,139 @@
+import pandas as pd
+import os
+import zipfile
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+EXPORT_CHUNK_ROWS = 50000
+
+def iter_file_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """Yield the contents of a file in fixed-size chunks"""
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def iter_gzip(chunks, level=6):
+    """Gzip-compress a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Query-argument suffixes of inclusive range filters
+RANGE_FILTER_OPS = {'__gte': '>=', '__lte': '<='}
+
+def parse_export_filters(args, reserved=('columns',)):
+    """
+    Parse export query arguments into (column, op, value) filters.
+
+    `<col>__gte` and `<col>__lte` give inclusive bounds, any other `<col>=<value>`
+    is an equality filter (comma-separated values match any of them).
+    """
+    filters = []
+    for key, value in args.items():
+        if key in reserved:
+            continue
+        for suffix, op in RANGE_FILTER_OPS.items():
+            if key.endswith(suffix):
+                try:
+                    filters.append((key[:-len(suffix)], op, float(value)))
+                except ValueError:
+                    raise ValueError(f"Filter {key} needs a numeric value, got {value!r}")
+                break
+        else:
+            filters.append((key, 'in', value.split(',')))
+    return filters
+
+def _apply_filters(chunk, filters):
+    """Apply parsed export filters to a DataFrame chunk"""
+    mask = pd.Series(True, index=chunk.index)
+    for col, op, value in filters:
+        if op == '>=':
+            mask &= pd.to_numeric(chunk[col], errors='coerce') >= value
+        elif op == '<=':
+            mask &= pd.to_numeric(chunk[col], errors='coerce') <= value
+        else:
+            mask &= chunk[col].astype(str).isin(value)
+    return chunk[mask]
+
+def iter_csv_export(file_path, columns=None, filters=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Stream a filtered/projected CSV export of a results table.
+
+    The table is read in row chunks so memory stays bounded regardless of size.
+    Columns and filters are validated before the generator is returned, so bad
+    requests fail before any response bytes are sent.
+    """
+    filters = filters or []
+    header = pd.read_csv(file_path, nrows=0).columns.tolist()
+
+    columns = columns or header
+    unknown = [col for col in columns + [f[0] for f in filters] if col not in header]
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(set(unknown))}")
+
+    range_cols = sorted({col for col, op, _ in filters if op != 'in'})
+    if range_cols:
+        sample = pd.read_csv(file_path, usecols=range_cols, nrows=chunk_rows)
+        non_numeric = [col for col in range_cols if not pd.api.types.is_numeric_dtype(sample[col])]
+        if non_numeric:
+            raise ValueError(f"Range filters need numeric columns: {non_numeric}")
+
+    usecols = list(dict.fromkeys(columns + [f[0] for f in filters]))
+
+    def generate():
+        first = True
+        for chunk in pd.read_csv(file_path, usecols=usecols, chunksize=chunk_rows):
+            chunk = _apply_filters(chunk, filters)[columns]
+            yield chunk.to_csv(index=False, header=first).encode('utf-8')
+            first = False
+        if first:
+            yield (','.join(columns) + '\n').encode('utf-8')
+
+    return generate()
+
+class _ZipStreamBuffer:
+    """Write-only, unseekable sink that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_zip_bundle(files, chunk_size=CHUNK_SIZE):
+    """
+    Stream a zip archive of (arcname, path) pairs.
+
+    Entries are deflated chunk by chunk into an unseekable sink, so the archive
+    is never held in memory or written to disk.
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for arcname, file_path in files:
+            if not os.path.exists(file_path):
+                continue
+            with bundle.open(arcname, mode='w', force_zip64=True) as entry:
+                for chunk in iter_file_chunks(file_path, chunk_size):
+                    entry.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()